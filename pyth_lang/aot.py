@@ -0,0 +1,219 @@
+# Ahead-of-time compilation of Pyth programs to standalone Python modules.
+#
+# The module holds the generated code in a function, preceded by the
+# definitions of env it needs: the builtins and variables the code refers
+# to, and everything those refer to in turn, found by walking the AST of
+# env.py. Importing the module neither loads the lexer, parser and code
+# generator nor runs them, and CPython caches the compiled module as .pyc.
+#
+# The generated code normally runs in the env.environment dict, which holds
+# both the builtins and the Pyth variables. In the module, environment is
+# the module's globals() and the code runs in a function that declares every
+# name it binds global, so it behaves the same. Every run starts from fresh
+# copies of the initial values of the variables, like env.setup does.
+#
+# Options are fixed at compile time. Profiling, sampling and parallel jobs
+# depend on the full runtime and are turned off.
+
+import ast
+import inspect
+import re
+import textwrap
+
+from . import env
+from .pyth import compile_source, __version__
+
+
+# Definitions of env replaced or not needed by the module's own runtime.
+EXCLUDED = {'environment', 'setup', 'open_output', 'run', 'execute'}
+
+# Functions whose first argument names a Pyth variable.
+NAMING_FUNCS = {'assign', 'post_assign', 'lazy_input', 'declare_input'}
+
+RELATIVE_IMPORT = re.compile(r'\bfrom \.(\w*) import ')
+
+HEADER = '''\
+# Pyth program compiled by pyth {version}. Do not edit.
+#
+{source}
+#
+# Import this module and call main(stdin) to get the output of the program
+# as string, or run(stdin, stdout) with text streams. Run it as a script to
+# use the standard streams.
+
+import io
+'''
+
+RUNTIME = '''
+
+environment = globals()
+
+OPTIONS = {options!r}
+
+# The names the program refers to, and the initial values of those that
+# exist before it runs.
+PROGRAM_NAMES = {names!r}
+_initial = {{name: environment[name] for name in PROGRAM_NAMES if name in environment}}
+
+
+def _program():
+{program}
+
+
+def run(stdin=None, stdout=None):
+    """Runs the program reading from stdin and writing to stdout, text
+    streams defaulting to sys.stdin and sys.stdout. Returns the number of
+    bytes written."""
+    global memo_size, numeric, budget, steps, output, input_order, input_lines
+
+    for name in PROGRAM_NAMES:
+        environment.pop(name, None)
+    environment.update(copy.deepcopy(_initial))
+
+    memo_size = OPTIONS['memo_size']
+    numeric = OPTIONS['numeric']
+    budget = steps = OPTIONS['budget']
+    output = OutputSink(stdout or sys.stdout, OPTIONS['max_output'] or None, OPTIONS['output_buffer'])
+    input_order = []
+    input_lines = []
+
+    old_stdin = sys.stdin
+    sys.stdin = stdin or sys.stdin
+    try:
+        {execute}
+    finally:
+        sys.stdin = old_stdin
+        output.flush()
+
+    return output.bytes_written
+
+
+def main(stdin=''):
+    """Runs the program with the string stdin as input and returns its
+    output. Exceptions raised by the program are passed on."""
+    stdout = io.StringIO()
+    run(io.StringIO(stdin), stdout)
+    return stdout.getvalue()
+
+
+if __name__ == '__main__':
+    run()
+'''
+
+
+def program_names(tree):
+    """Returns the names the generated code refers to, as (names, stored
+    names). Variables bound through assign and friends are included."""
+    names, stored = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+            if not isinstance(node.ctx, ast.Load):
+                stored.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            stored.add(node.name)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in NAMING_FUNCS):
+            variables = [arg.value for arg in node.args
+                         if isinstance(arg, ast.Constant) and isinstance(arg.value, str)]
+            names.update(variables)
+
+    return names, stored
+
+
+def top_level_names(stmt):
+    """Returns the names a top-level statement of env.py defines."""
+    if isinstance(stmt, (ast.FunctionDef, ast.ClassDef)):
+        return {stmt.name}
+    if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+        return {(alias.asname or alias.name).split('.')[0] for alias in stmt.names}
+    if isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+        targets = stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]
+        return {node.id for target in targets for node in ast.walk(target) if isinstance(node, ast.Name)}
+    return set()
+
+
+def extract_env(roots):
+    """Returns the source of the top-level definitions of env.py the names
+    in roots depend on, in their original order, with relative imports made
+    absolute."""
+    source = inspect.getsource(env)
+    lines = source.splitlines()
+    statements = ast.parse(source).body
+
+    defines = {}
+    for i, stmt in enumerate(statements):
+        for name in top_level_names(stmt) - EXCLUDED:
+            defines.setdefault(name, []).append(i)
+
+    needed = set()
+    todo = [name for name in roots if name in defines]
+    seen = set(todo)
+    while todo:
+        for i in defines[todo.pop()]:
+            if i in needed:
+                continue
+            needed.add(i)
+            for node in ast.walk(statements[i]):
+                if isinstance(node, ast.Name) and node.id in defines and node.id not in seen:
+                    seen.add(node.id)
+                    todo.append(node.id)
+
+    code = ''
+    previous = None
+    for i in sorted(needed):
+        stmt = statements[i]
+        imports = isinstance(stmt, (ast.Import, ast.ImportFrom))
+        if previous is not None:
+            code += '\n' if imports and previous else '\n\n\n'
+        previous = imports
+
+        start = min([stmt.lineno] + [d.lineno for d in getattr(stmt, 'decorator_list', [])])
+        code += '\n'.join(lines[start - 1:stmt.end_lineno])
+
+    package = env.__package__
+    return RELATIVE_IMPORT.sub(lambda m: 'from {} import '.format(
+        package + '.' + m.group(1) if m.group(1) else package), code)
+
+
+def compile_module(source, **overrides):
+    """Compiles the Pyth source (bytes) to the source of a standalone Python
+    module. Options can be given as keyword arguments, as for run_code."""
+    overrides.update(profile=False, sample=0, jobs=0)
+    code, options, _ = compile_source(source, **overrides)
+
+    tree = ast.parse(code)
+    names, stored = program_names(tree)
+
+    program = code
+    if stored:
+        program = 'global {}\n{}'.format(', '.join(sorted(stored)), code)
+    if not program.strip():
+        program = 'pass'
+
+    roots = names | {'OutputSink', 'sys', 'copy'}
+    if options['memo']:
+        roots.add('run_deep')
+
+    # Lines with control characters, which could end the comment or the
+    # module, are shown as string literals.
+    lines = source.decode('utf-8', errors='replace').rstrip('\n').split('\n')
+    header = HEADER.format(version=__version__, source='\n'.join(
+        '#     ' + (line if line.isprintable() else repr(line)) for line in lines))
+
+    runtime = RUNTIME.format(
+        options=dict(options), names=sorted(names), program=textwrap.indent(program, '    '),
+        execute='run_deep(_program)' if options['memo'] else '_program()')
+
+    return header + extract_env(roots) + '\n' + runtime
+
+
+def compile_file(path, output_path, **overrides):
+    """Compiles the Pyth program in path to a module written to output_path."""
+    with open(path, 'rb') as f:
+        source = f.read()
+
+    module = compile_module(source, **overrides)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(module)
@@ -0,0 +1,164 @@
+# Runs one Pyth program on many inputs, such as the test cases of a problem.
+#
+# The program is lexed, parsed, generated and compiled once. With more than
+# one worker the environment is set up once too, and every input runs in a
+# child forked from this process, which starts from a copy-on-write copy of
+# the prepared environment, so no run sees what another left behind. Up to
+# workers children run at a time, each sending its output and error back
+# through a pipe.
+#
+# With a single worker, or where fork is not available, the inputs run one
+# after another in this process, sharing the compiled code. Setting up a
+# fresh environment for each costs far less than forking.
+
+import collections
+import io
+import os
+import pickle
+import selectors
+import signal
+import sys
+
+from .output import OutputLimitError, OutputAborted
+from .pyth import compile_source
+from . import env
+
+
+class CaseError(Exception):
+    """An error raised by a program in a child that could not be passed back
+    as is, or the abnormal exit of the child."""
+
+
+def prepare(source, **overrides):
+    """Compiles source (a string) to a code object. Returns (code, options).
+    Profiling and sampling are turned off, their results would stay in the
+    children."""
+    overrides.update(profile=False, sample=0)
+    code, options, _ = compile_source(source.encode('utf-8'), **overrides)
+    return compile(code, '<pyth>', 'exec'), options
+
+
+def run_case(code, options, stdin, fresh=True):
+    """Runs a compiled program on stdin in this process, returning the output
+    and the exception raised, if any, like run_code. Unless fresh is true the
+    environment must have been set up already, and is used as is."""
+    stdout = io.StringIO()
+    error = None
+
+    try:
+        sys.stdout = stdout
+        sys.stdin = io.StringIO(stdin)
+        if fresh:
+            env.setup(options)
+        else:
+            env.open_output(options)
+        env.execute(code, options)
+    except (SystemExit, OutputAborted):
+        pass
+    except (Exception, OutputLimitError, env.BudgetExceededError) as e:
+        error = e
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stdin = sys.__stdin__
+
+    return stdout.getvalue(), error
+
+
+def portable(error):
+    """Returns error if it survives pickling intact, or else a CaseError
+    describing it."""
+    if error is None:
+        return None
+    try:
+        copy = pickle.loads(pickle.dumps(error))
+        if type(copy) is type(error) and str(copy) == str(error):
+            return error
+    except Exception:
+        pass
+    return CaseError('{}: {}'.format(type(error).__name__, error))
+
+
+def _child(code, options, stdin, fd):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    output, error = run_case(code, options, stdin, fresh=False)
+    with os.fdopen(fd, 'wb') as pipe:
+        pipe.write(pickle.dumps((output, portable(error))))
+
+
+def _result(data, status):
+    try:
+        return pickle.loads(data)
+    except Exception:
+        code = os.waitstatus_to_exitcode(status)
+        reason = 'killed by signal {}'.format(-code) if code < 0 else 'exited with status {}'.format(code)
+        return '', CaseError('the run {}'.format(reason))
+
+
+def run_many(source, stdins, workers=None, **overrides):
+    """Runs source once for every string in stdins, returning a list of
+    (output, error) pairs as run_code would. Options can be given as keyword
+    arguments. With more than one worker (by default the number of CPUs),
+    inputs run in forked children, at most workers at a time.
+
+    Errors that do not survive pickling, and children that die, are reported
+    as CaseError.
+    """
+    stdins = list(stdins)
+    try:
+        code, options = prepare(source, **overrides)
+    except Exception as e:
+        return [('', e)] * len(stdins)
+
+    workers = max(1, workers or os.cpu_count() or 1)
+    if workers == 1 or len(stdins) < 2 or not hasattr(os, 'fork'):
+        return [run_case(code, options, stdin) for stdin in stdins]
+
+    env.setup(options)
+
+    results = [None] * len(stdins)
+    todo = collections.deque(enumerate(stdins))
+    running = {}
+    selector = selectors.DefaultSelector()
+
+    # Anything still buffered would be written by every child as well.
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    try:
+        while todo or running:
+            while todo and len(running) < workers:
+                i, stdin = todo.popleft()
+                read_fd, write_fd = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        os.close(read_fd)
+                        _child(code, options, stdin, write_fd)
+                    finally:
+                        os._exit(0)
+
+                os.close(write_fd)
+                running[read_fd] = (i, pid, [])
+                selector.register(read_fd, selectors.EVENT_READ)
+
+            for key, _ in selector.select():
+                i, pid, chunks = running[key.fd]
+                data = os.read(key.fd, 1 << 16)
+                if data:
+                    chunks.append(data)
+                    continue
+
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                del running[key.fd]
+                _, status = os.waitpid(pid, 0)
+                results[i] = _result(b''.join(chunks), status)
+    finally:
+        for fd, (_, pid, _) in running.items():
+            selector.unregister(fd)
+            os.close(fd)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        selector.close()
+
+    return results
@@ -0,0 +1,278 @@
+# End-to-end benchmarks of the interpreter.
+#
+# The benchmark programs are the docstring tests of test.py plus a set of
+# heavier programs that exercise loops, big ranges, recursion and printing.
+# Every program is compiled and run a number of times, timing each phase of
+# the pipeline separately (see stats.py). Results can be saved as a JSON
+# baseline, and a later run compared against it: a program is flagged as a
+# regression if it got slower by more than a threshold and Welch's t-test
+# says the difference is significant.
+#
+# To measure the cost of an option, save a baseline without it and compare
+# a run with it, for example --budget with a budget no program exhausts.
+#
+# Usage: python -m pyth_lang.bench [--save FILE] [--compare FILE] ...
+
+import argparse
+import io
+import json
+import math
+import platform
+import re
+import statistics
+import sys
+
+from . import env
+from . import test
+from .pyth import compile_source, __version__
+from .stats import Stats
+
+
+# Heavier programs, as name: (source, stdin).
+SCALING_PROGRAMS = {
+    'loop-sum': ("=z0FU20000 =z+z*a3)z", ""),
+    'big-range-sum': ("sU50000", ""),
+    'map': ("lm*a2U5000", ""),
+    'filter-search': ("f>a30000", ""),
+    'sort': ("hS_U50000", ""),
+    'memo-recursion': (";# memo\nL?<a2a+LtaL-a2)L2000", ""),
+    'deep-recursion': (";# memo\nL?<a1 0hLta)L20000", ""),
+    'print-lines': ("FU20000a", ""),
+    'print-list': ("U50000", ""),
+    'nested-list': ("FU3000=w]w)l`w", ""),
+    'eval-input': ("lV", str(list(range(100000)))),
+}
+
+PHASES = ['preprocess', 'tokenize', 'parse', 'codegen', 'setup', 'compile', 'execute']
+
+
+def corpus(include_tests=True, include_scaling=True):
+    """Returns the benchmark programs as name: (source, stdin)."""
+    programs = {}
+
+    if include_tests:
+        for name, cls in vars(test).items():
+            if isinstance(cls, test.PythTest) and cls.__doc__:
+                for nr, (source, _) in enumerate(test.doc_tests(cls.__doc__), 1):
+                    programs['{}.{}'.format(name, nr)] = (source, "")
+
+    if include_scaling:
+        programs.update(SCALING_PROGRAMS)
+
+    return programs
+
+
+def run_once(source, stdin, overrides=None):
+    """Compiles and runs source once, returning the wall time per phase."""
+    stats = Stats(trace_memory=False)
+    try:
+        sys.stdout = io.StringIO()
+        sys.stdin = io.StringIO(stdin)
+        code, options, _ = compile_source(source.encode('utf-8'), stats, **(overrides or {}))
+        env.run(code, options, stats)
+    except (Exception, SystemExit, env.BudgetExceededError):
+        # Failing programs are timed up to the failure.
+        pass
+    finally:
+        sys.stdout = sys.__stdout__
+        sys.stdin = sys.__stdin__
+
+    times = {phase: result['wall'] for phase, result in stats.phases.items()}
+    times['total'] = sum(times.values())
+    return times
+
+
+def run_benchmarks(programs, repeat=5, warmup=1, progress=None, overrides=None):
+    """Runs every program warmup + repeat times, with the given options.
+    Returns name: phase: list of wall times of the repeated runs."""
+    results = {}
+    for i, (name, (source, stdin)) in enumerate(sorted(programs.items())):
+        for _ in range(warmup):
+            run_once(source, stdin, overrides)
+
+        samples = {}
+        for _ in range(repeat):
+            for phase, elapsed in run_once(source, stdin, overrides).items():
+                samples.setdefault(phase, []).append(elapsed)
+
+        results[name] = samples
+        if progress is not None:
+            progress(i + 1, len(programs), name)
+
+    return results
+
+
+def make_baseline(results, repeat, overrides=None):
+    return {
+        'pyth': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'options': overrides or {},
+        'results': results,
+    }
+
+
+# Welch's t-test.
+
+def welch(a, b):
+    """Returns (t, degrees of freedom, two-sided p-value) of Welch's t-test
+    for the means of samples a and b."""
+    mean_a, mean_b = statistics.fmean(a), statistics.fmean(b)
+    var_a = statistics.variance(a) / len(a) if len(a) > 1 else 0.0
+    var_b = statistics.variance(b) / len(b) if len(b) > 1 else 0.0
+
+    if var_a + var_b == 0:
+        return 0.0, float('inf'), 1.0 if mean_a == mean_b else 0.0
+
+    t = (mean_b - mean_a) / math.sqrt(var_a + var_b)
+    df = (var_a + var_b) ** 2 / (
+        (var_a ** 2 / (len(a) - 1) if len(a) > 1 else 0) +
+        (var_b ** 2 / (len(b) - 1) if len(b) > 1 else 0))
+    p = betainc(df / 2, 0.5, df / (df + t * t))
+    return t, df, p
+
+
+def betainc(a, b, x):
+    """The regularized incomplete beta function I_x(a, b)."""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log(1 - x))
+
+    # The continued fraction converges quickly for x < (a + 1) / (a + b + 2).
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1 - front * _betacf(b, a, 1 - x) / b
+
+
+def _betacf(a, b, x, iterations=200, eps=1e-12):
+    # Lentz's method for the continued fraction of the incomplete beta.
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+
+    for m in range(1, iterations + 1):
+        for numerator in (m * (b - m) * x / ((a + 2*m - 1) * (a + 2*m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2*m) * (a + 2*m + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= c * d
+
+        if abs(c * d - 1) < eps:
+            break
+
+    return h
+
+
+def compare(baseline, results, alpha=0.01, threshold=0.05, min_difference=1e-4):
+    """Compares results against a baseline. Returns a list of rows (name,
+    phase, old mean, new mean, relative change, p-value, verdict), where
+    verdict is 'slower', 'faster' or '' for insignificant changes. A change
+    is significant if its p-value is below alpha, and it is both more than
+    threshold relatively and more than min_difference seconds absolutely."""
+    rows = []
+    for name, samples in sorted(results.items()):
+        old_samples = baseline['results'].get(name)
+        if old_samples is None:
+            continue
+
+        for phase in ['total'] + PHASES:
+            if phase not in samples or phase not in old_samples:
+                continue
+
+            old, new = old_samples[phase], samples[phase]
+            old_mean, new_mean = statistics.fmean(old), statistics.fmean(new)
+            change = new_mean / old_mean - 1 if old_mean else 0.0
+            _, _, p = welch(old, new)
+
+            verdict = ''
+            if p < alpha and abs(change) > threshold and abs(new_mean - old_mean) > min_difference:
+                verdict = 'slower' if change > 0 else 'faster'
+            rows.append((name, phase, old_mean, new_mean, change, p, verdict))
+
+    return rows
+
+
+def format_results(results):
+    lines = ['{:<24} {:>12} {:>12} {:>12}'.format('program', 'total (ms)', 'stdev (ms)', 'execute (ms)')]
+    for name, samples in sorted(results.items()):
+        total = samples['total']
+        lines.append('{:<24} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+            name[:24], 1000 * statistics.fmean(total),
+            1000 * (statistics.stdev(total) if len(total) > 1 else 0.0),
+            1000 * statistics.fmean(samples.get('execute', [0.0]))))
+    return '\n'.join(lines)
+
+
+def format_comparison(rows, all_rows=False):
+    lines = ['{:<24} {:<10} {:>12} {:>12} {:>8} {:>9}  {}'.format(
+        'program', 'phase', 'old (ms)', 'new (ms)', 'change', 'p', '')]
+    for name, phase, old, new, change, p, verdict in rows:
+        if verdict or all_rows and phase == 'total':
+            lines.append('{:<24} {:<10} {:>12.3f} {:>12.3f} {:>+7.1f}% {:>9.2g}  {}'.format(
+                name[:24], phase, 1000 * old, 1000 * new, 100 * change, p, verdict))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser('python -m pyth_lang.bench', description='Pyth benchmarks.')
+    argparser.add_argument('-r', '--repeat', type=int, default=5, help='Timed runs per program.')
+    argparser.add_argument('-w', '--warmup', type=int, default=1, help='Untimed runs per program.')
+    argparser.add_argument('-k', '--filter', metavar='REGEX', help='Only run programs matching REGEX.')
+    argparser.add_argument('--no-tests', action='store_true', help='Leave out the test.py programs.')
+    argparser.add_argument('--no-scaling', action='store_true', help='Leave out the heavier programs.')
+    argparser.add_argument('--save', metavar='FILE', help='Save the results as JSON baseline.')
+    argparser.add_argument('--compare', metavar='FILE', help='Compare against a JSON baseline.')
+    argparser.add_argument('--alpha', type=float, default=0.01, help='Significance level (default 0.01).')
+    argparser.add_argument('--threshold', type=float, default=0.05,
+                           help='Minimum relative change to report (default 0.05).')
+    argparser.add_argument('--min-difference', type=float, default=0.1,
+                           help='Minimum absolute change in ms to report (default 0.1).')
+    argparser.add_argument('--budget', type=int, metavar='STEPS',
+                           help='Run with the budget option, to measure its overhead.')
+    argparser.add_argument('-v', '--verbose', action='store_true', help='Show all programs when comparing.')
+    args = argparser.parse_args(argv)
+
+    programs = corpus(not args.no_tests, not args.no_scaling)
+    if args.filter:
+        programs = {name: program for name, program in programs.items() if re.search(args.filter, name)}
+
+    def progress(done, total, name):
+        print('\r[{}/{}] {:<40}'.format(done, total, name[:40]), end='', file=sys.stderr, flush=True)
+
+    overrides = {'budget': args.budget} if args.budget else {}
+    results = run_benchmarks(programs, args.repeat, args.warmup, progress, overrides)
+    print(file=sys.stderr)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(make_baseline(results, args.repeat, overrides), f, indent=1)
+
+    if not args.compare:
+        print(format_results(results))
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    rows = compare(baseline, results, args.alpha, args.threshold, args.min_difference / 1000)
+    print(format_comparison(rows, args.verbose))
+
+    regressions = [row for row in rows if row[6] == 'slower' and row[1] == 'total']
+    print('{} programs compared, {} significantly slower, {} significantly faster.'.format(
+        len({row[0] for row in rows}), len(regressions),
+        len([row for row in rows if row[6] == 'faster' and row[1] == 'total'])))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
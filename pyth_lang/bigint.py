@@ -0,0 +1,96 @@
+# Conversion between big integers and decimal strings in sub-quadratic time.
+#
+# CPython's int() and str() on integers are quadratic in the number of
+# digits, and refuse to convert more than sys.get_int_max_str_digits()
+# digits at all. These divide-and-conquer conversions only ever convert
+# small pieces with int() and str(). Converting to a string goes through the
+# decimal module, whose multiplication is sub-quadratic for large operands.
+
+import decimal
+
+
+# Below these sizes the builtin conversions are fast, and within the digit
+# limit.
+STR_BITS_LIMIT = 8192
+INT_DIGITS_LIMIT = 2048
+
+# Numeric literals longer than this are converted with str_to_int, by
+# literal.parse_real.
+BIG_LITERAL = 1000
+
+
+def int_to_str(n):
+    """Returns str(n) for an int n of any size."""
+    if n.bit_length() <= STR_BITS_LIMIT:
+        return str(n)
+
+    return str(_int_to_decimal(n))
+
+
+def _int_to_decimal(n):
+    D = decimal.Decimal
+    powers = {}
+
+    def pow2(w):
+        # 2**w as Decimal, built from the powers used on the way down.
+        if w not in powers:
+            if w <= 128:
+                powers[w] = D(2) ** w
+            else:
+                half = w >> 1
+                powers[w] = pow2(half) * pow2(w - half)
+        return powers[w]
+
+    def inner(n, w):
+        if w <= 128:
+            return D(n)
+        half = w >> 1
+        hi = n >> half
+        lo = n - (hi << half)
+        return inner(lo, half) + inner(hi, w - half) * pow2(half)
+
+    with decimal.localcontext() as ctx:
+        ctx.prec = decimal.MAX_PREC
+        ctx.Emax = decimal.MAX_EMAX
+        ctx.Emin = decimal.MIN_EMIN
+        ctx.traps[decimal.Inexact] = True
+
+        if n < 0:
+            return -inner(-n, (-n).bit_length())
+        return inner(n, n.bit_length())
+
+
+def str_to_int(s):
+    """Returns int(s) for a string s of decimal digits, optionally preceded by
+    a sign, of any length."""
+    sign = 1
+    if s[:1] in ('+', '-'):
+        sign = -1 if s[0] == '-' else 1
+        s = s[1:]
+
+    if not (s.isascii() and s.isdigit()):
+        raise ValueError('invalid literal for str_to_int(): {!r}'.format(s))
+
+    if len(s) <= INT_DIGITS_LIMIT:
+        return sign * int(s)
+
+    powers = {}
+
+    def pow5(w):
+        if w not in powers:
+            if w <= 64:
+                powers[w] = 5 ** w
+            else:
+                half = w >> 1
+                powers[w] = pow5(half) * pow5(w - half)
+        return powers[w]
+
+    def inner(a, b):
+        # The value of s[a:b], as high part * 10**w + low part.
+        if b - a <= INT_DIGITS_LIMIT:
+            return int(s[a:b])
+        mid = (a + b + 1) >> 1
+        w = b - mid
+        return inner(mid, b) + ((inner(a, mid) * pow5(w)) << w)
+
+    return sign * inner(0, len(s))
@@ -0,0 +1,183 @@
+# A cache of the results of deterministic programs.
+#
+# The output of a Pyth program is determined by its source, its input, its
+# options and the interpreter version: none of the builtins depends on
+# randomness, time or the outside world. Outputs are stored on disk keyed by
+# a hash of the preprocessed source, stdin, resolved options and version,
+# such that rerunning a program on the same input costs a lookup. Only runs
+# that finished without error are stored. Programs profiled or sampled
+# (through options or meta-commands) are never looked up, as a hit would
+# skip their report. A nondeterministic builtin, if one is added, must make
+# result_key return None for programs using it.
+#
+# The store is an SQLite database, safe to share between processes, that is
+# kept under a size limit by evicting the least recently used results. It
+# also counts hits, misses and evictions.
+#
+# Pass a ResultCache as the cache argument of run_code, or use pyth --cache.
+# Run python -m pyth_lang.cache to see the counters, or with --clear to empty
+# the cache.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+
+from .lexer import Lexer, LexerError
+from .options import OptionError, resolve
+from .pyth import __version__
+
+
+DEFAULT_MAX_BYTES = 64 << 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, output TEXT, size INTEGER, used INTEGER);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+'''
+
+COUNTERS = ('hits', 'misses', 'evictions')
+
+
+def default_path():
+    """Returns the database path given by $PYTH_CACHE, or else a per-user
+    default."""
+    path = os.environ.get('PYTH_CACHE')
+    if path:
+        return path
+
+    directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(directory, 'pyth', 'results.sqlite3')
+
+
+def cacheable(options):
+    """Returns whether runs with the given (resolved) options may be looked
+    up in the cache. Profiled and sampled runs must really run."""
+    return not options['profile'] and not options['sample']
+
+
+def result_key(source, stdin, overrides=None):
+    """Returns the cache key of running source (bytes) on stdin with the
+    given options, or None if the run must not be cached or the program does
+    not get through the lexer."""
+    try:
+        lexer = Lexer(source)
+        options = resolve(lexer.meta, overrides)
+    except (LexerError, OptionError):
+        return None
+
+    if not cacheable(options):
+        return None
+
+    digest = hashlib.sha256()
+    parts = (__version__.encode('utf-8'), lexer.preprocessed_source(),
+             stdin.encode('utf-8', errors='surrogatepass'),
+             json.dumps(options, sort_keys=True).encode('utf-8'))
+    for part in parts:
+        digest.update(struct.pack('!Q', len(part)) + part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """An on-disk store of program outputs of at most max_bytes, evicting the
+    least recently used. A ResultCache must not be shared between processes
+    or threads, but any number of them can use the same path."""
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_path()
+        self.max_bytes = max_bytes
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _tick(self):
+        """Returns the next value of the clock ordering uses."""
+        self._count('clock')
+        return self.db.execute("SELECT value FROM counters WHERE name = 'clock'").fetchone()[0]
+
+    def _count(self, name, n=1):
+        self.db.execute('INSERT INTO counters VALUES (?, ?) '
+                        'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value', (name, n))
+
+    def get(self, key):
+        """Returns the output stored under key, or None."""
+        with self.db:
+            row = self.db.execute('SELECT output FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+
+            self._count('hits')
+            self.db.execute('UPDATE results SET used = ? WHERE key = ?', (self._tick(), key))
+            return row[0]
+
+    def put(self, key, output):
+        """Stores output under key, evicting the least recently used outputs
+        to stay within max_bytes. Outputs larger than that are not stored."""
+        size = len(key) + len(output.encode('utf-8', errors='surrogatepass'))
+        if size > self.max_bytes:
+            return
+
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                            (key, output, size, self._tick()))
+
+            total = self.db.execute('SELECT SUM(size) FROM results').fetchone()[0]
+            evicted = []
+            for old_key, old_size in self.db.execute('SELECT key, size FROM results ORDER BY used'):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((old_key,))
+                total -= old_size
+
+            if evicted:
+                self.db.executemany('DELETE FROM results WHERE key = ?', evicted)
+                self._count('evictions', len(evicted))
+
+    def clear(self):
+        """Removes all outputs and resets the counters."""
+        with self.db:
+            self.db.execute('DELETE FROM results')
+            self.db.execute('DELETE FROM counters')
+
+    def stats(self):
+        """Returns the counters and the number and total size of the stored
+        outputs."""
+        counters = dict(self.db.execute('SELECT name, value FROM counters'))
+        entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        stats = {name: counters.get(name, 0) for name in COUNTERS}
+        stats.update(entries=entries, bytes=size, max_bytes=self.max_bytes)
+        return stats
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser('python -m pyth_lang.cache',
+                                        description='Show or clear the Pyth result cache.')
+    argparser.add_argument('--path', default=default_path(),
+                           help='Cache database (default: {}).'.format(default_path()))
+    argparser.add_argument('--clear', action='store_true', help='Remove all results.')
+    args = argparser.parse_args(argv)
+
+    with ResultCache(args.path) as cache:
+        if args.clear:
+            cache.clear()
+        print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
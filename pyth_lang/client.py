@@ -0,0 +1,125 @@
+# Thin client of the fork server daemon (forkserver.py).
+#
+# Sends its arguments and working directory to the daemon, together with its
+# stdin, stdout and stderr as file descriptors, and exits with the status of
+# the run. SIGINT, SIGTERM and SIGHUP are forwarded to the child running the
+# request, once the daemon has reported its pid. If no daemon is listening the program is run in-process, as the
+# pyth command would.
+#
+# This module only imports the standard library, such that the client starts
+# as fast as Python does.
+
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+
+
+FORWARDED_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGHUP')
+
+
+def socket_path():
+    """Returns the socket path given by $PYTH_SOCKET, or else a per-user
+    default."""
+    path = os.environ.get('PYTH_SOCKET')
+    if path:
+        return path
+
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, 'pyth-{}.sock'.format(os.getuid()))
+
+
+def connect(path):
+    """Returns a socket connected to the daemon at path, or None if none is
+    listening."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def send_request(sock, request, fds):
+    """Sends a request (a JSON-serializable dict) and the file descriptors,
+    as a length-prefixed message."""
+    data = json.dumps(request).encode('utf-8')
+    data = struct.pack('!I', len(data)) + data
+    sent = socket.send_fds(sock, [data], fds)
+    sock.sendall(data[sent:])
+
+
+def receive_request(sock):
+    """Receives a request sent by send_request. Returns (request, fds)."""
+    data, fds, _, _ = socket.recv_fds(sock, 65536, 3)
+    while len(data) < 4 or len(data) < 4 + struct.unpack('!I', data[:4])[0]:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError('incomplete request')
+        data += chunk
+
+    return json.loads(data[4:].decode('utf-8')), fds
+
+
+def deliver(pid, signum):
+    """Sends a signal to the child running the request, unless it is gone."""
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def run(sock, argv):
+    """Runs argv on the daemon connected to sock. Returns the exit status."""
+    send_request(sock, {'argv': argv, 'cwd': os.getcwd()}, [0, 1, 2])
+
+    pid = None
+    status = None
+    # Signals received before the daemon reported the pid of the child.
+    pending = []
+
+    def forward(signum, frame):
+        if pid is None:
+            pending.append(signum)
+        else:
+            deliver(pid, signum)
+
+    for name in FORWARDED_SIGNALS:
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), forward)
+
+    with sock.makefile('rb') as replies:
+        for line in replies:
+            reply = json.loads(line.decode('utf-8'))
+            if pid is None and 'pid' in reply:
+                pid = reply['pid']
+                while pending:
+                    deliver(pid, pending.pop(0))
+            status = reply.get('status', status)
+
+    if status is None:
+        print('pyth: the daemon stopped before the program finished', file=sys.stderr)
+        return 1
+    return status
+
+
+def main():
+    sock = connect(socket_path())
+    if sock is None:
+        from .pyth import cli
+        cli()
+        return
+
+    with sock:
+        sys.exit(run(sock, sys.argv[1:]))
+
+
+if __name__ == '__main__':
+    main()
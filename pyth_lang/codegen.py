@@ -1,3 +1,11 @@
+import re
+
+from .bigint import BIG_LITERAL
+from .options import resolve
+from .parser import VARIABLES
+from .sourcemap import SourceMap, mark, strip
+
+
 # Simple one-to-one function translation.
 EXPR_FUNC = {
     '!':  'Pnot',
@@ -42,16 +50,60 @@ EXPR_PATTERNS = {
 }
 
 # Lambda pattern. 0 is the lambda variable(s) separated by commas, the rest are arguments.
+# tick is the step taken on every call when the budget option is enabled.
 LAMBDA_VARS = 'abcde'
 EXPR_LAMBDA_PATTERNS = {
-    'f':       {1: 'Pfilter(Real(1), lambda {0}: {1})',
-                2: 'Pfilter({1}, lambda {0}: {2})'},
-    'm':       {2: '[{2} for {0} in makeiter({1})]'},
-    'o':       {2: 'order_by({1}, lambda {0}: {2})'},
-    'init-L':  {1: "assign('L', lambda {0}: {1})",
-                2: "assign('L', lambda {0}: {1})({2})"}
+    'f':       {1: 'Pfilter(Real(1), lambda {0}: {tick}{1})',
+                2: 'Pfilter({1}, lambda {0}: {tick}{2})'},
+    'm':       {2: '[{tick}{2} for {0} in makeiter({1})]'},
+    'o':       {2: 'order_by({1}, lambda {0}: {tick}{2})'},
+    'init-L':  {1: "assign('L', lambda {0}: {tick}{1})",
+                2: "assign('L', lambda {0}: {tick}{1})({2})"}
+}
+
+# Lambda patterns that replace the above when the memo option is enabled.
+MEMO_LAMBDA_PATTERNS = {
+    'init-L':  {1: "assign('L', memoize(lambda {0}: {tick}{1}))",
+                2: "assign('L', memoize(lambda {0}: {tick}{1}))({2})"}
+}
+
+# Step taken at the start of lambda calls and loop iterations when the budget
+# option is enabled. tick() returns None, so the lambda returns the value of
+# the expression after the or.
+TICK_EXPR = 'tick() or '
+TICK_LOOPS = 'FW#'
+
+# Lambda patterns that replace the above when the jobs option is enabled and the
+# lambda is pure. The lambda source and the variables it uses are also passed.
+PARALLEL_LAMBDA_PATTERNS = {
+    'f':       {1: 'Pfilter_parallel(Real(1), lambda {0}: {1}, {src!r}, {names!r})',
+                2: 'Pfilter_parallel({1}, lambda {0}: {2}, {src!r}, {names!r})'},
+    'm':       {2: 'Pmap_parallel({1}, lambda {0}: {2}, {src!r}, {names!r})'},
+}
+
+# Function and lambda patterns that replace the above when the numpy option is
+# enabled. Vectorisable lambdas also pass their expression tree.
+VECTOR_FUNC = {
+    'S':  'vector_sorted',
 }
 
+VECTOR_LAMBDA_PATTERNS = {
+    'f':       {1: 'vector_filter(Real(1), lambda {0}: {1}, {tree!r})',
+                2: 'vector_filter({1}, lambda {0}: {2}, {tree!r})'},
+    'm':       {2: 'vector_map({1}, lambda {0}: {2}, {tree!r})'},
+}
+
+# Symbols that can be vectorised on integers, with their arity.
+VECTOR_OPS = {'!': 1, '_': 1, '+': 2, '-': 2, '*': 2, '<': 2, '>': 2, 'q': 2, 'n': 2}
+
+# Symbols that make an expression impure: they have side effects, depend on
+# input, or call L (which is not available to worker processes).
+IMPURE = {'=', '~', 'p', 'v', 'V', '$l', 'L'}
+
+# Generated code starting with a call of this form calls a builtin, which is
+# instrumented when the profile option is enabled.
+BUILTIN_CALL = re.compile(r'([A-Za-z_]\w*)\(')
+
 # Block patterns. In order: block indentation, prologue and epilogue. Arguments are given through format parameters.
 BLOCK_PATTERNS = {
     '#': [2, ['while True:', '    try:'], ['    except Exception:', '        break']],
@@ -68,21 +120,28 @@ class CodegenError(Exception):
 
 
 class Codegen:
-    def __init__(self, parser):
+    def __init__(self, parser, options=None):
         self.parser = parser
+        self.options = options or resolve(parser.lex.meta)
         self.ast = parser.parse()
         self.arity_seen = set()
         self.lambda_var = 0
+        self.lambda_depth = 0
 
     def gen_code(self):
         code = "\n".join(self._gen_block(self.ast))
-        if self.parser.should_init_var['V'] > 0:
-            code = "V = Peval(input())\n" + code
-        if self.parser.should_init_var['v'] > 0:
-            code = "v = input()\n" + code
 
+        # Input variables are read lazily, a line each, in the order v, V.
+        input_vars = self._input_vars()
+        if input_vars:
+            code = "declare_input({})\n".format(', '.join(map(repr, input_vars))) + code
+
+        code, self.source_map = SourceMap.extract(code, self.parser.lex.original_offset)
         return code
 
+    def _input_vars(self):
+        return [var for var in 'vV' if self.parser.should_init_var[var] > 0]
+
     def _gen_block(self, node, level=0):
         assert node.type == 'block'
 
@@ -98,7 +157,7 @@ class Codegen:
             elif child.type == 'expr':
                 child_code = self._gen_expr(child)
             elif child.type == 'lit':
-                child_code = self._gen_lit(child)
+                child_code = self._gen_expr(child)
             else:
                 raise CodegenError("unknown child type: '{}'".format(child.type))
 
@@ -117,17 +176,36 @@ class Codegen:
         if node.data in 'EFI' and not lines:
             lines = ['pass']
 
+        if self.options['budget'] and node.data in TICK_LOOPS:
+            lines.insert(0, 'tick()')
+
         if node.data in BLOCK_PATTERNS:
             ident, prologue, epilogue = BLOCK_PATTERNS[node.data]
             prologue = [line.format(*args) for line in prologue]
             epilogue = [line.format(*args) for line in epilogue]
             lines = prologue + [" "*(4 * ident) + line for line in lines] + epilogue
+            lines[0] = self._mark(node) + lines[0]
         elif node.data != 'root':
             raise CodegenError("unknown block type: '{}'".format(node.data))
 
         return lines
 
+    def _mark(self, node):
+        return '' if node.pos is None else mark(node.pos)
+
     def _gen_expr(self, node):
+        code = self._gen_expr_code(node)
+
+        if self.options['profile'] and node.type == 'expr' and node.pos is not None:
+            call = BUILTIN_CALL.match(code)
+            if call:
+                func = call.group(1)
+                offset = self.parser.lex.original_offset(node.pos)
+                code = "prof_call({0}, '{0}', {1}, {2}".format(func, offset, code[call.end():])
+
+        return self._mark(node) + code
+
+    def _gen_expr_code(self, node):
         assert node.type == 'expr' or node.type == 'lit'
 
         if node.type == 'lit':
@@ -138,30 +216,103 @@ class Codegen:
 
         if node.data in EXPR_LAMBDA_PATTERNS:
             patterns = EXPR_LAMBDA_PATTERNS[node.data]
+            if self.options['memo']:
+                patterns = MEMO_LAMBDA_PATTERNS.get(node.data, patterns)
             if len(node.args) not in patterns:
                 raise CodegenError("arity of '{}' must be one of {}".format(node.data, sorted(patterns.keys())))
             var = LAMBDA_VARS[self.lambda_var % len(LAMBDA_VARS)]
             self.lambda_var += 1
+            self.lambda_depth += 1
             exprs = [self._gen_expr(arg) for arg in node.args]
             self.lambda_var -= 1
-            return patterns[len(node.args)].format(var, *exprs)
+            self.lambda_depth -= 1
+
+            # Vectorised lambdas make no calls to tick, so budgeted programs
+            # don't use them.
+            vector = self.options['numpy'] and not self.options['budget']
+            tree = self._vector_tree(node.args[-1], var) if vector else None
+            if tree is not None and node.data in VECTOR_LAMBDA_PATTERNS:
+                patterns = VECTOR_LAMBDA_PATTERNS[node.data]
+                return patterns[len(node.args)].format(var, *exprs, tree=tree)
+
+            # Parallel lambdas run in other processes, so they and their
+            # sequence must be pure, and they may not refer to variables of enclosing lambdas.
+            # Profiled and budgeted programs don't run lambdas in parallel,
+            # as the calls in worker processes would go unrecorded.
+            if (self.options['jobs'] > 1 and not self.options['profile'] and not self.options['budget']
+                    and node.data in PARALLEL_LAMBDA_PATTERNS
+                    and self.lambda_depth == 0 and all(map(self._is_pure, node.args))):
+                patterns = PARALLEL_LAMBDA_PATTERNS[node.data]
+                return patterns[len(node.args)].format(
+                    var, *exprs,
+                    src='lambda {}: {}'.format(var, strip(exprs[-1])),
+                    names=sorted(self._variables(node.args[-1])))
+
+            tick = TICK_EXPR if self.options['budget'] else ''
+            return patterns[len(node.args)].format(var, *exprs, tick=tick)
 
         if node.data in EXPR_PATTERNS:
             patterns = EXPR_PATTERNS[node.data]
             if len(node.args) not in patterns:
                 raise CodegenError("arity of '{}' must be one of {}".format(node.data, sorted(patterns.keys())))
-            return patterns[len(node.args)].format(*map(self._gen_expr, node.args))
+            args = list(map(self._gen_expr, node.args))
+            if node.data in '=~':
+                # The assigned variable is a name, not a value.
+                args[0] = self._gen_name(node.args[0])
+            return patterns[len(node.args)].format(*args)
 
         if node.data in EXPR_FUNC:
             args = map(self._gen_expr, node.args)
-            return '{}({})'.format(EXPR_FUNC[node.data], ', '.join(args))
+            func = EXPR_FUNC[node.data]
+            if self.options['numpy']:
+                func = VECTOR_FUNC.get(node.data, func)
+            return '{}({})'.format(func, ', '.join(args))
 
         raise CodegenError("AST node ('{}', '{}') not implemented".format(node.type, node.data))
 
+    def _is_pure(self, node):
+        if node.data in IMPURE or node.data.startswith('init-'):
+            return False
+
+        return all(self._is_pure(arg) for arg in node.args)
+
+    def _variables(self, node):
+        if node.type == 'lit':
+            return {self._gen_lit(node)} if node.data in VARIABLES else set()
+
+        return set().union(*map(self._variables, node.args))
+
+    def _vector_tree(self, node, var):
+        """Returns the expression as tree of nested tuples (op, *args), with
+        'x' for the lambda variable and ints for literals, or None if it can't
+        be vectorised."""
+        if node.type == 'lit':
+            if node.data == var:
+                return 'x'
+            if node.data.isdigit():
+                return int(node.data)
+            return None
+
+        if VECTOR_OPS.get(node.data) != len(node.args):
+            return None
+
+        args = [self._vector_tree(arg, var) for arg in node.args]
+        if None in args:
+            return None
+        return (node.data, *args)
+
     def _gen_lit(self, node):
         if node.data[-1] in '0123456789.':
+            if len(node.data) > BIG_LITERAL:
+                return "parse_real('{}')".format(node.data)
             return "Real('{}')".format(node.data)
 
+        if node.data in self._input_vars():
+            return "lazy_input('{}')".format(node.data)
+
+        return self._gen_name(node)
+
+    def _gen_name(self, node):
         if node.data.startswith('$'):
             return 'dollar_' + node.data[1:]
 
@@ -1,11 +1,22 @@
+import collections
 import collections.abc
 import itertools
 import functools
 import copy
+import sys
+import threading
 import sympy as sym
 
 from sympy import Rational as Real
 
+from .options import resolve
+from .output import OutputSink
+from .stats import Stats
+from .bigint import int_to_str, str_to_int
+from .formatting import format_rational
+from .literal import parse_literal, parse_real
+from . import vector
+
 
 class BadTypeCombinationError(Exception):
     def __init__(self, func, *args):
@@ -19,9 +30,49 @@ class BadTypeCombinationError(Exception):
         return error_message
 
 
+class BudgetExceededError(BaseException):
+    """Raised when a program runs out of its budget of steps.
+
+    Like OutputLimitError, this derives from BaseException so that it is not
+    swallowed by the error handling of Pyth's # (forever) blocks.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+
+    def __str__(self):
+        return 'step budget of {} exceeded'.format(self.budget)
+
+
 # The environment of Pyth.
 environment = {}
 precision = Real(20)
+memo_size = 65536
+jobs = 0
+par_threshold = 10000
+numeric = False
+
+# Where programs write their output to, see setup.
+output = None
+
+# The Profile of the current run, if the profile option is enabled.
+profile = None
+
+# The Sampler of the current run, if the sample option is enabled.
+sampler = None
+
+# The budget option, and the steps left of it. Every loop iteration and
+# lambda call takes a step when the budget is enabled, see tick.
+budget = 0
+steps = 0
+
+# The variables read from stdin, a line each, and the lines read so far.
+input_order = []
+input_lines = []
+
+# Deep recursion (used with memoized L) runs in a thread with this stack size.
+deep_stack_size = 512 * 1024 * 1024
+deep_recursion_limit = 1000000
 
 
 # Helper functions.
@@ -34,7 +85,7 @@ def isstr(obj):
 
 
 def islist(obj):
-    return isinstance(obj, list)
+    return isinstance(obj, (list, ByteString))
 
 
 def isseq(obj):
@@ -81,21 +132,194 @@ def Pstr(a):
             return 'inf'
         if a == -sym.oo:
             return '-inf'
+        if a.is_Integer:
+            return int_to_str(int(a))
         if a.is_integer:
             return str(a)
+        if a.is_Rational:
+            s = format_rational(a.p, a.q, int(precision))
+            if s is not None:
+                return s
 
         s = str(a.evalf(precision)).rstrip('0').rstrip('.')
         return s or '0'
 
     if islist(a):
-        return '[{}]'.format(', '.join(map(Prepr, a)))
+        return ''.join(str_pieces(a))
 
     return str(a)
 
 
+def str_pieces(a):
+    """Yields Pstr(a) in pieces. Nested lists are walked with an explicit
+    stack rather than recursion, so they can be arbitrarily deep."""
+    if not islist(a):
+        yield Pstr(a)
+        return
+
+    yield '['
+    stack = [iter(a)]
+    sep = False
+    while stack:
+        for e in stack[-1]:
+            if sep:
+                yield ', '
+            if islist(e):
+                yield '['
+                stack.append(iter(e))
+                sep = False
+                break
+
+            yield Prepr(e)
+            sep = True
+        else:
+            stack.pop()
+            yield ']'
+            sep = True
+
+
+# Pieces are joined into chunks of this many characters before writing.
+write_chunk_size = 65536
+
+
+def write_str(a, write):
+    """Writes Pstr(a) in chunks using the write function, without building
+    the full string for large lists."""
+    if not islist(a):
+        write(Pstr(a))
+        return
+
+    chunk = []
+    size = 0
+    for piece in str_pieces(a):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= write_chunk_size:
+            write(''.join(chunk))
+            chunk = []
+            size = 0
+
+    if chunk:
+        write(''.join(chunk))
+
+
 def autoprint(a):
     if a is not None:
-        print(Pstr(a))
+        write_str(a, output.write)
+        output.write('\n')
+
+
+def approx(a):
+    """In numeric mode, evaluates irrational (symbolic) reals to floating
+    point with the current precision, such that they stop growing as
+    expressions. Rationals and all other values are returned unchanged."""
+    if numeric and isreal(a) and not a.is_Rational and not a.is_Float:
+        return a.evalf(precision)
+
+    return a
+
+
+def declare_input(*names):
+    """Declares the variables that are read from stdin, in order. They are
+    read lazily by lazy_input."""
+    global input_order
+    input_order = list(names)
+
+
+def lazy_input(name):
+    """Returns the value of the input variable name, reading its line from
+    stdin (and any lines of variables before it) on first access. v is the
+    line as string, V the line evaluated."""
+    if name not in environment:
+        index = input_order.index(name)
+        while len(input_lines) <= index:
+            input_lines.append(input())
+
+        line = input_lines[index]
+        environment[name] = Peval(line) if name == 'V' else line
+
+    return environment[name]
+
+
+class InputLines:
+    """Iterates lazily over the remaining lines of stdin."""
+
+    def __iter__(self):
+        for line in iter(sys.stdin.readline, ''):
+            yield line[:-1] if line.endswith('\n') else line
+
+    def __repr__(self):
+        return '<stdin lines>'
+
+
+# The values of bytes, shared by all binary strings.
+BYTE_VALUES = [Real(i) for i in range(256)]
+
+
+class ByteString(collections.abc.Sequence):
+    """A binary string literal: a read-only list of reals viewing the bytes
+    the literal was compiled to. Elements are only looked up when accessed,
+    and operations that build a new list return a regular list."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ByteString(self.data[i])
+        return BYTE_VALUES[self.data[i]]
+
+    def __iter__(self):
+        return map(BYTE_VALUES.__getitem__, self.data)
+
+    def __contains__(self, a):
+        if isinstance(a, sym.Integer):
+            return 0 <= a < 256 and int(a) in self.data
+        return any(e == a for e in self)
+
+    def __eq__(self, other):
+        if isinstance(other, ByteString):
+            return self.data == other.data
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __lt__(self, other):
+        if islist(other):
+            return list(self) < list(other)
+        return NotImplemented
+
+    def __gt__(self, other):
+        if islist(other):
+            return list(self) > list(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, ByteString):
+            return ByteString(self.data + other.data)
+        if isinstance(other, list):
+            return list(self) + other
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + list(self)
+        return NotImplemented
+
+    def __mul__(self, n):
+        return ByteString(self.data * int(n))
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return repr(list(self.data))
 
 
 def makeiter(a):
@@ -112,17 +336,64 @@ def freeze(a):
     return a
 
 
-def normalize(a):
-    if isinstance(a, tuple):
-        return [normalize(e) for e in a]
+def memoize(func):
+    cache = collections.OrderedDict()
+    maxsize = memo_size
 
-    if isinstance(a, (int, float)):
-        return Real(a)
+    def memoized(*args):
+        key = tuple(freeze(arg) for arg in args)
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
 
-    if isinstance(a, complex):
-        raise RuntimeError('complex numbers not yet supported in Pyth')
+        result = func(*args)
+        cache[key] = result
+        if len(cache) > maxsize:
+            cache.popitem(last=False)
+        return result
+
+    return memoized
+
+
+def tick():
+    """Takes a step of the budget. Calls are generated at the start of every
+    loop iteration and lambda call when the budget option is enabled."""
+    global steps
+    steps -= 1
+    if steps < 0:
+        raise BudgetExceededError(budget)
 
-    return a
+
+def run_deep(func, *args):
+    """Runs func(*args) with an enlarged stack and recursion limit."""
+
+    outcome = []
+
+    def target():
+        try:
+            func(*args)
+        except BaseException as e:
+            outcome.append(e)
+
+    old_stack_size = threading.stack_size(deep_stack_size)
+    old_limit = sys.getrecursionlimit()
+    try:
+        sys.setrecursionlimit(max(old_limit, deep_recursion_limit))
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(old_stack_size)
+        sys.setrecursionlimit(old_limit)
+
+    if outcome:
+        raise outcome[0]
+
+
+def snapshot(names):
+    """Returns the current values of the given variables, skipping those
+    that are not defined."""
+    return {name: environment[name] for name in names if name in environment}
 
 
 # !
@@ -136,7 +407,7 @@ def Pnot(a):
 # (
 def Peval(a):
     if isstr(a):
-        return normalize(eval(a))
+        return parse_literal(a)
 
     raise BadTypeCombinationError('Peval', a)
 
@@ -182,7 +453,7 @@ def plus(a=None, b=None):
     if issig('r_', a, b):
         return sym.Abs(a)
 
-    if issig('rr', a, b) or type(a) is type(b):
+    if issig('rr', a, b) or issig('ll', a, b) or type(a) is type(b):
         return a + b
 
     if issig('al', a, b):
@@ -256,7 +527,7 @@ def times(a, b=None):
 # ^
 def power(a, b):
     if issig('rr', a, b):
-        return sym.Pow(a, b)
+        return approx(sym.Pow(a, b))
 
     if issig('sr', a, b):
         return [p + q for p, q in itertools.product(a, repeat=sym.floor(b))]
@@ -281,6 +552,9 @@ def post_assign(a, b):
     if not isstr(a):
         raise BadTypeCombinationError('post-assign', a, b)
 
+    if a not in environment and a in input_order:
+        lazy_input(a)
+
     old = environment[a]
     environment[a] = b
     return old
@@ -397,6 +671,33 @@ def Pfilter(a, b):
     raise BadTypeCombinationError('Pfilter', a, b)
 
 
+def Pfilter_parallel(a, b, source, names):
+    """Pfilter, but searches for the first match of a real a in parallel.
+
+    The lambda b is also given as source, together with the names of the
+    variables it references, such that worker processes can rebuild it.
+    """
+    if not isreal(a) or jobs < 2:
+        return Pfilter(a, b)
+
+    from . import parallel
+    return parallel.first_match(sym.floor(a), b, source, snapshot(names), jobs)
+
+
+def vector_filter(a, b, tree):
+    """Pfilter, with the lambda b also given as vectorisable expression tree."""
+    if isreal(a):
+        n, rest = vector.search_tree(int(sym.floor(a)), tree)
+        if n is not None:
+            return Real(n)
+        return Pfilter(Real(rest), b)
+
+    result = vector.filter_tree(a, tree)
+    if result is None:
+        return Pfilter(a, b)
+    return result
+
+
 # g
 # h
 def head(a):
@@ -421,12 +722,36 @@ def Plen(a):
         return Real(len(a))
 
     if isreal(a):
-        return sym.log(a, 2)
+        return approx(sym.log(a, 2))
 
     raise BadTypeCombinationError('Plen', a)
 
 
 # m
+def Pmap_parallel(a, b, source, names):
+    """The m lambda, but maps large sequences in chunks over worker processes.
+    Sequences without a length, such as lazily read input, are mapped here.
+
+    The lambda b is also given as source, together with the names of the
+    variables it references, such that worker processes can rebuild it.
+    """
+    a = makeiter(a)
+    if jobs < 2 or not isinstance(a, collections.abc.Sized) or len(a) < par_threshold:
+        return [b(e) for e in a]
+
+    from . import parallel
+    return parallel.map_chunks(a, b, source, snapshot(names), jobs)
+
+
+def vector_map(a, b, tree):
+    """The m lambda, with b also given as vectorisable expression tree."""
+    a = makeiter(a)
+    result = vector.map_tree(a, tree)
+    if result is None:
+        return [b(e) for e in a]
+    return result
+
+
 # n
 def not_equals(a, b):
     return Real(bool(a != b))
@@ -442,7 +767,7 @@ def order_by(a, b):
 
 # p
 def Pprint(a):
-    print(Pstr(a), end="")
+    write_str(a, output.write)
     return a
 
 
@@ -455,13 +780,14 @@ def equals(a, b):
 # s
 def Psum(a):
     if isstr(a):
-        return Real(a)
+        return parse_real(a)
 
     if islist(a):
-        if a:
-            return functools.reduce(plus, a)
+        # Adding machine integers is far cheaper than adding sympy Integers.
+        if all(isinstance(e, sym.Integer) for e in a):
+            return Real(sum(map(int, a)))
 
-        return Real(0)
+        return functools.reduce(plus, a)
 
     if isreal(a):
         return sym.floor(a)
@@ -528,6 +854,15 @@ def Psorted(a):
     raise BadTypeCombinationError('Psorted', a)
 
 
+def vector_sorted(a):
+    if islist(a):
+        order = vector.sort_order(a)
+        if order is not None:
+            return [a[i] for i in order]
+
+    return Psorted(a)
+
+
 # T
 def pop(a):
     if isseq(a):
@@ -561,7 +896,7 @@ def factorial(a):
         if not a.is_integer:
             a = a.evalf(precision)
 
-        return sym.factorial(a)
+        return approx(sym.factorial(a))
 
     raise BadTypeCombinationError('factorial', a)
 
@@ -672,6 +1007,10 @@ def rightshift(a, b):
 dollar_a = 'abcdefghijklmnopqrstuvwxyz'
 
 
+# $l
+dollar_l = InputLines()
+
+
 # $q
 dollar_q = 'qwertyuiopasdfghjklzxcvbnm'
 
@@ -684,13 +1023,101 @@ dollar_A = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 dollar_Q = 'QWERTYUIOPASDFGHJKLZXCVBNM'
 
 
-def run(code):
-    blacklist = {'collections', 'itertools', 'copy', 'sym', 'functools',
-                 'BadTypeCombinationError',
-                 'isreal', 'isstr', 'islist', 'isseq', 'issig', 'real_to_range',
-                 'run'}
+def setup(options=None):
+    """Configures the runtime with the given options and fills a clean
+    environment for a program to run in."""
+
+    global memo_size, jobs, par_threshold, numeric, budget, steps, input_order, input_lines, profile, sampler
+
+    blacklist = {'collections', 'itertools', 'copy', 'sym', 'functools', 'sys', 'threading',
+                 'BadTypeCombinationError', 'BudgetExceededError', 'budget', 'steps',
+                 'isreal', 'isstr', 'islist', 'BYTE_VALUES', 'isseq', 'issig', 'real_to_range',
+                 'resolve', 'Stats', 'memo_size', 'deep_stack_size', 'deep_recursion_limit', 'run_deep',
+                 'jobs', 'par_threshold', 'snapshot', 'vector', 'numeric',
+                 'str_pieces', 'write_str', 'write_chunk_size', 'output', 'OutputSink',
+                 'input_order', 'input_lines', 'profile', 'sampler',
+                 'format_rational', 'int_to_str', 'str_to_int', 'parse_literal',
+                 'setup', 'open_output', 'run', 'execute'}
     environment.clear()
     clean_env = {k: copy.deepcopy(v) for k, v in globals().items() if k not in blacklist and not k.startswith('_')}
     environment.update(clean_env)
 
-    exec(code, environment)
+    options = options or resolve()
+    memo_size = options['memo_size']
+    jobs = options['jobs']
+    par_threshold = options['par_threshold']
+    numeric = options['numeric']
+    budget = steps = options['budget']
+    open_output(options)
+    input_order = []
+    input_lines = []
+
+    profile = None
+    if options['profile']:
+        from .profiler import Profile
+        profile = Profile()
+        environment['prof_call'] = profile.call
+
+    sampler = None
+    if options['sample']:
+        from .sampler import Sampler
+        sampler = Sampler(options['sample'] / 1000)
+
+    return options
+
+
+def open_output(options):
+    """Directs the output of the program to sys.stdout, limited and buffered
+    as options say."""
+    global output
+    output = OutputSink(sys.stdout, options['max_output'] or None, options['output_buffer'])
+
+
+def run(code, options=None, stats=None):
+    stats = stats or Stats(trace_memory=False)
+
+    with stats.phase('setup'):
+        options = setup(options)
+
+    # Compiled under its own file name, such that frames of the program can
+    # be told apart and looked up in its source map.
+    with stats.phase('compile'):
+        code = compile(code, '<pyth>', 'exec')
+
+    return execute(code, options, stats)
+
+
+def execute(code, options, stats=None):
+    """Runs a compiled program in the environment prepared by setup. Returns
+    the number of bytes written."""
+    stats = stats or Stats(trace_memory=False)
+
+    global issig
+    plain_issig = issig
+    if profile is not None:
+        issig = profile.wrap_issig(issig)
+
+    def target():
+        # The sampler samples the thread it is started from.
+        if sampler is not None:
+            sampler.start()
+        try:
+            exec(code, environment)
+        finally:
+            if sampler is not None:
+                sampler.stop()
+
+    try:
+        with stats.phase('execute'):
+            if options['memo']:
+                # Memoized recursion is typically deep recursion.
+                run_deep(target)
+            else:
+                target()
+    finally:
+        issig = plain_issig
+        if profile is not None:
+            profile.stop()
+        output.flush()
+
+    return output.bytes_written
@@ -0,0 +1,162 @@
+# A daemon that runs the pyth command line without paying for start-up.
+#
+# Starting pyth means starting Python, importing sympy and the interpreter,
+# which takes far longer than running a typical program. The daemon does
+# this once, then listens on a Unix socket. For every request it forks a
+# child, which runs pyth.cli() with the client's arguments and working
+# directory, and the client's stdin, stdout and stderr, passed over the
+# socket as file descriptors. Output therefore goes straight to the client's
+# streams. The child reports its pid at the start, such that the client can
+# forward signals, and its exit status at the end.
+#
+# Use client.py (the pythc command) to talk to the daemon, and start it with
+# the pyth-forkserver command.
+#
+# Usage: python -m pyth_lang.forkserver [--socket PATH]
+
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+from . import client
+
+
+def serve(path):
+    """Listens on the Unix socket path forever, forking a child for every
+    connection."""
+    from . import pyth
+
+    # Import and initialize everything a run needs up front, including the
+    # parts of sympy that are imported lazily.
+    pyth.run_code("+1 1")
+
+    if os.path.exists(path):
+        if client.connect(path) is not None:
+            sys.exit('pyth: a daemon is already listening on {}'.format(path))
+        os.unlink(path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(64)
+
+    # Children are reaped automatically, they report their own status.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except InterruptedError:
+                continue
+
+            if not same_user(conn):
+                conn.close()
+                continue
+
+            if os.fork() == 0:
+                listener.close()
+                try:
+                    handle(conn)
+                finally:
+                    os._exit(0)
+
+            conn.close()
+    finally:
+        listener.close()
+        os.unlink(path)
+
+
+def same_user(conn):
+    """Returns whether the peer of conn runs as the same user, where this can
+    be checked."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid == os.getuid()
+
+
+def handle(conn):
+    """Runs a request in the forked child."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    request, fds = client.receive_request(conn)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    sys.stdin = sys.__stdin__ = io.TextIOWrapper(open(0, 'rb', closefd=False))
+    sys.stdout = sys.__stdout__ = io.TextIOWrapper(open(1, 'wb', closefd=False),
+                                                   line_buffering=os.isatty(1))
+    sys.stderr = sys.__stderr__ = io.TextIOWrapper(open(2, 'wb', closefd=False),
+                                                   line_buffering=True, errors='backslashreplace')
+
+    conn.sendall(json.dumps({'pid': os.getpid()}).encode('utf-8') + b'\n')
+
+    status = run(request)
+    conn.sendall(json.dumps({'status': status}).encode('utf-8') + b'\n')
+    conn.close()
+
+
+def run(request):
+    """Runs pyth.cli() for a request, returning the exit status."""
+    from . import pyth
+
+    os.chdir(request['cwd'])
+    sys.argv = ['pyth'] + request['argv']
+
+    try:
+        pyth.cli()
+        status = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            status = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except KeyboardInterrupt:
+        status = 128 + signal.SIGINT
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except OSError:
+            pass
+
+    return status
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser('python -m pyth_lang.forkserver',
+                                        description='Pyth fork server daemon.')
+    argparser.add_argument('--socket', default=client.socket_path(),
+                           help='Unix socket to listen on (default: {}).'.format(client.socket_path()))
+    args = argparser.parse_args(argv)
+
+    if not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'):
+        sys.exit('pyth: the fork server needs fork and Unix sockets')
+
+    try:
+        serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Fast formatting of rationals, giving exactly the same output as the
+# original str(a.evalf(precision)) (with trailing zeros stripped), but
+# without creating sympy Floats or going through the sympy printer.
+#
+# Note that the last digit of that output is not always the correctly
+# rounded decimal digit: evalf first rounds to a binary float (truncating to
+# prec + 4 bits, then rounding to nearest at prec bits) and mpmath then
+# truncates that to dps + 3 decimal digits before rounding half up on the
+# first dropped digit. Exact decimal rounding would differ in the last digit
+# for a few percent of values, so we do these same steps in exact integer
+# arithmetic instead.
+
+import functools
+import math
+
+from mpmath.libmp import dps_to_prec, prec_to_dps
+
+
+# Beyond this binary exponent mpmath uses a different, approximate method to
+# find the decimal exponent, which we don't reproduce.
+MAX_EXPONENT = 3500
+
+LOG2_10 = math.log(10, 2)
+
+
+@functools.lru_cache(maxsize=4096)
+def format_rational(p, q, dps):
+    """Returns p/q (q > 0, p/q not an integer) formatted like Pstr, or None
+    if the value is out of the supported range."""
+
+    sign = '-' if p < 0 else ''
+    p = abs(p)
+    prec = dps_to_prec(dps)
+
+    # Truncate p/q to prec + 4 bits: p/q ~ man * 2**exp.
+    exp = p.bit_length() - q.bit_length() - (prec + 4)
+    man = (p << -exp) // q if exp < 0 else p // (q << exp)
+    if man.bit_length() > prec + 4:
+        man >>= 1
+        exp += 1
+
+    # Round to nearest at prec bits, ties to even.
+    man, rem = divmod(man, 16)
+    if rem > 8 or rem == 8 and man & 1:
+        man += 1
+    exp += 4
+
+    bc = man.bit_length()
+    if abs(exp + bc) > MAX_EXPONENT:
+        return None
+
+    # Truncate to a decimal digit string, like mpmath.libmp.to_digits_exp.
+    out_dps = prec_to_dps(prec)
+    bitprec = int((out_dps + 3) * LOG2_10) + 10
+    fixprec = max(bitprec - exp - bc, 0)
+    fixdps = int(fixprec / LOG2_10 + 0.5)
+    offset = exp + fixprec
+    fixed = man << offset if offset >= 0 else man >> -offset
+    digits = str(fixed * 10**fixdps >> fixprec)
+    exponent = len(digits) - fixdps - 1
+
+    # Round half up on the first dropped digit, like mpmath.libmp.to_str.
+    if len(digits) > out_dps and digits[out_dps] in '56789':
+        digits = str(int(digits[:out_dps]) + 1)
+        if len(digits) > out_dps:
+            digits = digits[:out_dps]
+            exponent += 1
+    else:
+        digits = digits[:out_dps]
+
+    if -max(out_dps // 3, 5) < exponent < out_dps:
+        if exponent < 0:
+            digits = '0' * -exponent + digits
+            split = 1
+        else:
+            split = exponent + 1
+            digits += '0' * (split - out_dps)
+        exponent = 0
+    else:
+        split = 1
+
+    digits = digits[:split] + '.' + digits[split:]
+    if exponent > 0:
+        digits += 'e+' + str(exponent)
+    elif exponent < 0:
+        digits += 'e' + str(exponent)
+
+    return (sign + digits).rstrip('0').rstrip('.') or '0'
@@ -5,7 +5,8 @@ import collections
 class LexerError(Exception):
     pass
 
-Token = collections.namedtuple('Token', ['type', 'data'])
+# pos is the offset of the token in the preprocessed source.
+Token = collections.namedtuple('Token', ['type', 'data', 'pos'], defaults=[None])
 
 
 class Lexer:
@@ -14,20 +15,37 @@ class Lexer:
     SYMB = b" !&|?();[],_+-*/%^=<>:@{}`'~#"
 
     def __init__(self, src):
-        self.cache = []
+        self.cache = collections.deque()
         self.idx = 0
         self.src = src
+        self.original_src = src
+        self.meta = {}
         self._preprocess()
 
     def preprocessed_source(self):
         return self.src
 
+    def original_offset(self, pos):
+        """Returns the offset in the original source of the character at
+        offset pos in the preprocessed source."""
+        return self.offsets[pos]
+
     def has_token(self):
         # Newlines only seperate tokens, just ignore.
         while self._hasc() and self._peekc() == b'\n':
             self.idx += 1
         return bool(self.cache or self._hasc())
 
+    def tokenize(self):
+        """Reads all remaining tokens into the cache at once, instead of as
+        the parser asks for them. Returns the number of tokens."""
+        while True:
+            while self._hasc() and self._peekc() == b'\n':
+                self.idx += 1
+            if not self._hasc():
+                return len(self.cache)
+            self.cache.append(self.get_token(ignore_cache=True))
+
     def peek_token(self, ahead=0):
         while len(self.cache) <= ahead:
             self.cache.append(self.get_token(ignore_cache=True))
@@ -35,7 +53,7 @@ class Lexer:
 
     def get_token(self, *args, ignore_cache=False):
         if self.cache and not ignore_cache:
-            return self.cache.pop(0)
+            return self.cache.popleft()
 
         # Newlines only seperate tokens, just ignore.
         while self._hasc() and self._peekc() == b'\n':
@@ -44,6 +62,10 @@ class Lexer:
         if not self._hasc():
             raise LexerError('expected character, found EOF')
 
+        start = self.idx
+        return self._read_token()._replace(pos=start)
+
+    def _read_token(self):
         c = self._getc()
         if c.lower() in self.ALPHA + self.SYMB:
             return Token('symb', c.decode('utf-8'))
@@ -74,7 +96,7 @@ class Lexer:
 
         c = self._getc()
         if c == b'"':
-            return Token('lit', repr(list(self._tok_str())))
+            return Token('lit', 'ByteString({!r})'.format(self._tok_str()))
 
         return Token('symb', (b'.' + c).decode('utf-8'))
 
@@ -133,25 +155,35 @@ class Lexer:
         # Meta command results.
         end_meta = None
 
+        # The preprocessed lines, and for every character in them its offset
+        # in the original source.
         lines = [b'']
+        offsets = [[]]
+
+        def add(s, pos):
+            lines[-1] += s
+            offsets[-1].extend([pos] * len(s))
+
         while self._hasc():
+            pos = self.idx
             c = self._getc()
 
             # Don't normalize anything in binary strings.
             if binstring:
-                lines[-1] += c
+                add(c, pos)
 
                 if c == b'\\':
-                    lines[-1] += self._getc()
+                    add(self._getc(), pos + 1)
                 elif c == b'"':
                     binstring = False
 
             # Normalize newline.
             elif c in b'\r\n':
                 if string:
-                    lines[-1] += b'\n'
+                    add(b'\n', pos)
                 else:
                     lines.append(b'')
+                    offsets.append([])
 
                 # Greedily read \r\n.
                 if c == b'\r' and self._peekc() == b'\n':
@@ -159,10 +191,10 @@ class Lexer:
 
             # Handle string state.
             elif string:
-                lines[-1] += c
+                add(c, pos)
 
                 if c == b'\\' and self._peekc() == b'"':
-                    lines[-1] += self._getc()
+                    add(self._getc(), pos + 1)
                 elif c == b'"':
                     string = False
 
@@ -180,6 +212,7 @@ class Lexer:
                             self.idx += 1
                         if c in b'\r\n':
                             lines.append(b'')
+                            offsets.append([])
                             break
 
                         comment += c
@@ -187,17 +220,23 @@ class Lexer:
                     # Meta-command.
                     if comment.startswith(b'#'):
                         meta = comment[1:].strip()
-                        if meta == b'end' and end_meta is None:
-                            end_meta = len(lines) - 1
+                        if meta == b'end':
+                            if end_meta is None:
+                                end_meta = len(lines) - 1
+                        elif meta:
+                            # Other meta-commands are recorded as name and
+                            # optional argument, see options.py.
+                            name, _, arg = meta.partition(b' ')
+                            self.meta[name.decode('utf-8')] = arg.strip().decode('utf-8') or True
 
                 # Regular characters.
                 else:
-                    lines[-1] += c
+                    add(c, pos)
 
                     if c == b'"':
                         string = True
                     elif c == b'.' and self._peekc() == b'"':
-                        lines[-1] += self._getc()
+                        add(self._getc(), pos + 1)
                         binstring = True
                     elif c == b'\\':
                         if self._hasc():
@@ -207,22 +246,29 @@ class Lexer:
                             if c == b'\r' and self._peekc() == b'\n':
                                 self.idx += 1
 
-                            lines[-1] += b'\n' if c in b'\r\n' else c
+                            add(b'\n' if c in b'\r\n' else c, pos + 1)
 
         # Handle the end metacommand.
         if end_meta is not None:
             lines = lines[:end_meta]
+            offsets = offsets[:end_meta]
 
-        self.src = self._preprocess_whitespace(lines)
+        self.src, self.offsets = self._preprocess_whitespace(lines, offsets)
         self.idx = 0
 
-    def _preprocess_whitespace(self, lines):
+    def _preprocess_whitespace(self, lines, offsets):
         # Strip all trailing whitespace and an even amount of spaces from the
         # beginning.
-        lines = [re.sub(b'^((  )|\t)*', b'', line.rstrip()) for line in lines]
+        stripped = []
+        for line, line_offsets in zip(lines, offsets):
+            line = line.rstrip()
+            start = re.match(b'^((  )|\t)*', line).end()
+            stripped.append((line[start:], line_offsets[start:len(line)]))
 
         # Remove empty lines.
-        lines = [line for line in lines if line.strip()]
+        stripped = [(line, line_offsets) for line, line_offsets in stripped if line.strip()]
+        lines = [line for line, _ in stripped]
+        offsets = [line_offsets for _, line_offsets in stripped]
 
         # Concatenate lines, unless a line ends in a number or period and the
         # next line begins in a number (the only time a newline is necessary).
@@ -231,7 +277,16 @@ class Lexer:
             if not (lines[linenr][-1] in b'.0123456789' and
                     lines[linenr + 1][:1].isdigit()):
                 lines[linenr] += lines.pop(linenr + 1)
+                offsets[linenr] += offsets.pop(linenr + 1)
             else:
                 linenr += 1
 
-        return b'\n'.join(lines)
+        # The newlines joining the lines are mapped to the character after
+        # the end of the line they follow.
+        all_offsets = []
+        for line_offsets in offsets:
+            if all_offsets:
+                all_offsets.append(all_offsets[-1] + 1)
+            all_offsets += line_offsets
+
+        return b'\n'.join(lines), all_offsets
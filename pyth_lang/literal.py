@@ -0,0 +1,178 @@
+# A parser for Python literal syntax, used by Peval to evaluate input.
+#
+# It accepts numbers, strings, True, False, None and (nested) lists and
+# tuples, and builds Pyth values directly: numbers become reals and tuples
+# become lists. Unlike eval it can't run arbitrary code, and unlike eval
+# followed by a conversion pass it makes a single pass over the input
+# without recursion, so very large or deeply nested inputs are fine.
+
+import ast
+import math
+import re
+
+from sympy import Integer, Rational, oo
+
+from .bigint import str_to_int, INT_DIGITS_LIMIT, BIG_LITERAL
+
+
+class LiteralError(ValueError):
+    def __init__(self, message, pos):
+        self.message = message
+        self.pos = pos
+
+    def __str__(self):
+        return '{} at position {}'.format(self.message, self.pos)
+
+
+TOKEN = re.compile(r'''\s*(?:
+    (?P<number>[-+]?\s*[0-9.][0-9a-zA-Z_.]*(?:(?<=[eE])[-+][0-9_]+)?)
+  | (?P<string>[rRuU]?(?:'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"))
+  | (?P<open>[\[(])
+  | (?P<close>[\])])
+  | (?P<comma>,)
+  | (?P<name>True|False|None)\b
+)''', re.VERBOSE)
+
+# A run of small integers separated by commas, the bulk of large inputs.
+INTEGERS = re.compile(r'(?:\s*-?(?:0|[1-9][0-9]{0,17})\s*,)+')
+
+NAMES = {'True': Integer(1), 'False': Integer(0), 'None': None}
+BRACKETS = {']': '[', ')': '('}
+
+
+def parse_number(tok, pos):
+    """Converts a Python numeric literal to a real."""
+    tok = ''.join(tok.split())
+    digits = tok.lstrip('+-')
+
+    try:
+        if digits.isdigit():
+            if digits[0] == '0' and digits.strip('0'):
+                raise LiteralError('leading zeros in integers are not permitted', pos)
+            if len(digits) > INT_DIGITS_LIMIT:
+                return Integer(str_to_int(tok))
+            return Integer(int(tok))
+
+        if digits[:2].lower() in ('0x', '0o', '0b'):
+            return Integer(int(tok, 0))
+
+        if digits[-1:] in 'jJ':
+            raise LiteralError('complex numbers not yet supported in Pyth', pos)
+
+        value = float(tok)
+        if math.isinf(value):
+            # Too large for a float, as eval would have it.
+            return oo if value > 0 else -oo
+        return Rational(*value.as_integer_ratio())
+    except ValueError as e:
+        if isinstance(e, LiteralError):
+            raise
+        raise LiteralError('invalid number {!r}'.format(tok), pos) from None
+
+
+def parse_real(s):
+    """Rational(s), but converts long decimal literals in sub-quadratic
+    time."""
+    if len(s) > BIG_LITERAL:
+        sign = '-' if s[:1] == '-' else ''
+        whole, dot, frac = s.lstrip('+-').partition('.')
+        digits = whole + frac
+        if digits.isascii() and digits.isdigit():
+            return Rational(str_to_int(sign + digits), 10**len(frac))
+
+    return Rational(s)
+
+
+def parse_string(tok):
+    """Converts a Python string literal to a string."""
+    if '\\' not in tok and tok[0] in '\'"':
+        return tok[1:-1]
+    return ast.literal_eval(tok)
+
+
+def parse_literal(s):
+    """Parses s as a Python literal and returns it as a Pyth value. Raises
+    LiteralError if s is not a valid literal."""
+
+    # The open brackets with their elements so far and whether they contain a
+    # comma. The outermost level is an implicit tuple, like in Python.
+    brackets = ['']
+    elements = [[]]
+    commas = [False]
+
+    expect_value = True
+    kind = None
+    pos = 0
+    end = len(s.rstrip())
+    match = TOKEN.match
+
+    while pos < end:
+        m = match(s, pos)
+        if m is None:
+            pos += len(s[pos:]) - len(s[pos:].lstrip())
+            raise LiteralError('invalid syntax', pos)
+
+        last_kind = kind
+        kind = m.lastgroup
+        tok = m.group(kind)
+        start = m.start(kind)
+        pos = m.end()
+
+        if kind == 'comma':
+            if expect_value:
+                raise LiteralError('invalid syntax', start)
+            commas[-1] = True
+            expect_value = True
+            continue
+
+        if kind == 'close':
+            if brackets[-1] != BRACKETS[tok]:
+                raise LiteralError("unmatched '{}'".format(tok), start)
+            bracket = brackets.pop()
+            value = elements.pop()
+            if bracket == '(' and len(value) == 1 and not commas[-1]:
+                value = value[0]
+            commas.pop()
+            elements[-1].append(value)
+            expect_value = False
+            continue
+
+        if not expect_value:
+            # Adjacent strings are concatenated, like in Python.
+            if kind == 'string' and last_kind == 'string':
+                elements[-1][-1] += parse_string(tok)
+                continue
+            raise LiteralError('invalid syntax', start)
+
+        if kind == 'open':
+            brackets.append(tok)
+            elements.append([])
+            commas.append(False)
+
+            # Convert a run of integers all at once.
+            run = INTEGERS.match(s, pos)
+            if run:
+                elements[-1].extend(map(Integer, map(int, run.group().split(',')[:-1])))
+                commas[-1] = True
+                pos = run.end()
+            continue
+
+        if kind == 'number':
+            value = parse_number(tok, start)
+        elif kind == 'string':
+            value = parse_string(tok)
+        else:
+            value = NAMES[tok]
+
+        elements[-1].append(value)
+        expect_value = False
+
+    if len(brackets) > 1:
+        raise LiteralError("'{}' was never closed".format(brackets[-1]), end)
+
+    if not elements[0] or expect_value and not commas[0]:
+        raise LiteralError('unexpected end of input', end)
+
+    if commas[0]:
+        return elements[0]
+    return elements[0][0]
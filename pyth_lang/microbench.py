@@ -0,0 +1,298 @@
+# Microbenchmarks of the builtins, per overload.
+#
+# Most builtins dispatch on the types of their arguments with issig patterns
+# such as 'rr' or 'ql', and the overloads differ wildly in cost. The
+# overloads of every builtin in codegen.EXPR_FUNC are read from its source:
+# the issig patterns it tests, the type checks (isreal(a), ...) of single
+# argument builtins, and an all 'a' pattern if it has a fallback instead of
+# raising BadTypeCombinationError.
+#
+# Every overload is called on inputs of increasing size n, where a real is n
+# itself and a string or list has n elements. Time and allocated memory per
+# call are measured at each size, and a complexity exponent k is fitted such
+# that the cost grows as n^k. Sizes stop growing once a call takes too long.
+#
+# Usage: python -m pyth_lang.microbench [-k REGEX] [--max-size N] [--json FILE]
+
+import argparse
+import ast
+import inspect
+import json
+import math
+import os
+import re
+import signal
+import sys
+import textwrap
+import threading
+import time
+import tracemalloc
+
+from . import env
+from .codegen import EXPR_FUNC
+from .options import resolve
+
+
+TYPE_CHECKS = {'isreal': 'r', 'isstr': 's', 'islist': 'l', 'isseq': 'q'}
+
+# The complexity exponent is fitted to this many of the largest sizes.
+FIT_POINTS = 3
+
+
+class Timeout(BaseException):
+    pass
+
+
+def overloads():
+    """Returns a list of (symbol, builtin name, pattern) of every overload of
+    the builtins in EXPR_FUNC, in the order the builtins test them."""
+    result = []
+    for symbol, name in EXPR_FUNC.items():
+        func = getattr(env, name, None)
+        if not inspect.isfunction(func):
+            continue
+        for pattern in signatures(func):
+            result.append((symbol, name, pattern))
+    return result
+
+
+def signatures(func):
+    """Returns the type patterns func dispatches on, read from its source."""
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func))).body[0]
+    params = [arg.arg for arg in tree.args.args]
+
+    patterns = []
+    calls = [node for node in ast.walk(tree)
+             if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)]
+    for node in sorted(calls, key=lambda node: (node.lineno, node.col_offset)):
+        if node.func.id == 'issig' and isinstance(node.args[0], ast.Constant):
+            patterns.append(node.args[0].value)
+        elif (node.func.id in TYPE_CHECKS and len(params) == 1 and len(node.args) == 1
+                and isinstance(node.args[0], ast.Name) and node.args[0].id == params[0]):
+            patterns.append(TYPE_CHECKS[node.func.id])
+
+    if not isinstance(tree.body[-1], ast.Raise):
+        patterns.append('a' * len(params))
+
+    return list(dict.fromkeys(patterns))
+
+
+def make_arg(code, n):
+    """Returns an argument of size n for a type code."""
+    if code == '_':
+        return None
+    if code in 'ra':
+        return env.Real(n)
+    if code == 's':
+        return ('abcdefghijklmnopqrstuvwxyz' * (n // 26 + 1))[:n]
+    return [env.Real(i) for i in range(n)]
+
+
+def measure(func, pattern, n, min_time=0.05, timeout=None):
+    """Calls func on arguments of size n. Returns (seconds per call, bytes
+    allocated by a call), the allocation being the peak memory use. The
+    arguments are reused between calls, builtins don't modify them."""
+    args = [make_arg(code, n) for code in pattern]
+
+    with deadline(timeout):
+        tracemalloc.start()
+        try:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            allocated = tracemalloc.get_traced_memory()[1] - start_memory
+        finally:
+            tracemalloc.stop()
+
+        # The best of as many calls as fit in min_time.
+        best = total = 0.0
+        calls = 0
+        while calls == 0 or total < min_time and calls < 10000:
+            start = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - start
+            best = min(best, elapsed) if calls else elapsed
+            total += elapsed
+            calls += 1
+
+    return best, allocated
+
+
+class deadline:
+    """Raises Timeout in the block after the given number of seconds, on
+    platforms with SIGALRM and in the main thread only. Code that doesn't
+    return to the interpreter (a long running C function) can't be
+    interrupted."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.enabled = (seconds is not None and hasattr(signal, 'setitimer')
+                        and threading.current_thread() is threading.main_thread())
+
+    def __enter__(self):
+        if self.enabled:
+            self.previous = signal.signal(signal.SIGALRM, self._expire)
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
+
+    @staticmethod
+    def _expire(signum, frame):
+        raise Timeout()
+
+
+def fit_exponent(points):
+    """Fits cost = c * n^k to (n, cost) points by least squares on a log-log
+    scale. Returns k, or None with fewer than two usable points."""
+    points = [(math.log(n), math.log(cost)) for n, cost in points if n > 0 and cost > 0]
+    if len(points) < 2:
+        return None
+
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def predict(sizes, costs, growth):
+    """Predicts the cost at the next size, growth times the last, assuming at
+    least linear growth."""
+    k = fit_exponent(zip(sizes[-FIT_POINTS:], costs[-FIT_POINTS:])) or 1.0
+    return costs[-1] * growth ** max(1.0, k)
+
+
+def benchmark(symbol, name, pattern, sizes, budget=1.0, memory_budget=1 << 28,
+              timeout=5.0, min_time=0.05):
+    """Measures an overload at the given sizes, in increasing order. Stops at
+    the first size where a call fails, times out, or would be expected to
+    take more than budget seconds or allocate more than memory_budget bytes
+    judging by the previous sizes."""
+    func = getattr(env, name)
+    result = {'symbol': symbol, 'builtin': name, 'signature': pattern,
+              'sizes': [], 'times': [], 'allocated': [], 'error': None}
+
+    # Overloads not taking anything sized are measured once.
+    if not any(code in 'rslqa' for code in pattern):
+        sizes = sizes[:1]
+
+    for n in sizes:
+        if result['sizes']:
+            growth = n / result['sizes'][-1]
+            if (predict(result['sizes'], result['times'], growth) > budget or
+                    predict(result['sizes'], result['allocated'], growth) > memory_budget):
+                break
+
+        try:
+            elapsed, allocated = measure(func, pattern, n, min_time, timeout)
+        except Timeout:
+            result['error'] = 'timeout at n = {}'.format(n)
+            break
+        except (Exception, RecursionError) as e:
+            result['error'] = '{} at n = {}'.format(type(e).__name__, n)
+            break
+
+        result['sizes'].append(n)
+        result['times'].append(elapsed)
+        result['allocated'].append(allocated)
+
+        if elapsed > budget or allocated > memory_budget:
+            break
+
+    # At small sizes constant overhead dominates, fit the largest sizes.
+    result['time_exponent'] = fit_exponent(zip(result['sizes'][-FIT_POINTS:], result['times'][-FIT_POINTS:]))
+    result['memory_exponent'] = fit_exponent(zip(result['sizes'][-FIT_POINTS:],
+                                                  result['allocated'][-FIT_POINTS:]))
+    return result
+
+
+def run_matrix(pattern_filter=None, max_size=1 << 16, factor=4, progress=None, **kwargs):
+    """Benchmarks all overloads whose 'symbol name signature' matches the
+    regex pattern_filter. Returns a list of results as from benchmark."""
+    sizes = []
+    n = 1
+    while n <= max_size:
+        sizes.append(n)
+        n *= factor
+
+    selected = [overload for overload in overloads()
+                if pattern_filter is None or re.search(pattern_filter, ' '.join(overload))]
+
+    # Pprint writes to the runtime's output.
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            env.setup(resolve())
+            results = []
+            for i, overload in enumerate(selected):
+                results.append(benchmark(*overload, sizes, **kwargs))
+                if progress is not None:
+                    progress(i + 1, len(selected), overload)
+        finally:
+            sys.stdout = stdout
+
+    return results
+
+
+def format_exponent(k):
+    return '-' if k is None else '{:.2f}'.format(k)
+
+
+def format_report(results):
+    lines = ['{:<4} {:<16} {:<4} {:>8} {:>12} {:>12} {:>7} {:>7}  {}'.format(
+        'sym', 'builtin', 'sig', 'max n', 'time (us)', 'alloc (B)', 'k time', 'k mem', 'note')]
+    for result in results:
+        if result['sizes']:
+            n, elapsed, allocated = result['sizes'][-1], result['times'][-1], result['allocated'][-1]
+            lines.append('{:<4} {:<16} {:<4} {:>8} {:>12.1f} {:>12} {:>7} {:>7}  {}'.format(
+                result['symbol'], result['builtin'], result['signature'], n, 1e6 * elapsed,
+                allocated, format_exponent(result['time_exponent']),
+                format_exponent(result['memory_exponent']), result['error'] or ''))
+        else:
+            lines.append('{:<4} {:<16} {:<4} {:>8} {:>12} {:>12} {:>7} {:>7}  {}'.format(
+                result['symbol'], result['builtin'], result['signature'],
+                '-', '-', '-', '-', '-', result['error'] or ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser('python -m pyth_lang.microbench',
+                                        description='Pyth builtin microbenchmarks.')
+    argparser.add_argument('-k', '--filter', metavar='REGEX',
+                           help="Only run overloads whose 'symbol builtin signature' matches REGEX.")
+    argparser.add_argument('--max-size', type=int, default=1 << 16, help='Largest input size.')
+    argparser.add_argument('--factor', type=int, default=4, help='Growth factor of the input size.')
+    argparser.add_argument('--budget', type=float, default=0.5,
+                           help='Stop growing an overload when a call would take longer (seconds).')
+    argparser.add_argument('--memory-budget', type=int, default=256,
+                           help='Stop growing an overload when a call would allocate more (MiB).')
+    argparser.add_argument('--timeout', type=float, default=5.0, help='Maximum time per size (seconds).')
+    argparser.add_argument('--sort', action='store_true', help='Sort by time exponent, highest first.')
+    argparser.add_argument('--json', metavar='FILE', help='Write the results as JSON.')
+    args = argparser.parse_args(argv)
+
+    def progress(done, total, overload):
+        print('\r[{}/{}] {:<40}'.format(done, total, ' '.join(overload)), end='', file=sys.stderr, flush=True)
+
+    results = run_matrix(args.filter, args.max_size, args.factor, progress,
+                         budget=args.budget, memory_budget=args.memory_budget << 20,
+                         timeout=args.timeout)
+    print(file=sys.stderr)
+
+    if args.sort:
+        results.sort(key=lambda result: -(result['time_exponent'] or 0))
+    print(format_report(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
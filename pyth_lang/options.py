@@ -0,0 +1,69 @@
+# Options change how a program is compiled and run. They can be set from
+# within the program through meta-commands (;# name [value]) or from the
+# outside through the command line or the run_code API, the latter taking
+# precedence.
+
+
+class OptionError(Exception):
+    pass
+
+
+DEFAULTS = {
+    'memo': False,
+    'memo_size': 65536,
+    'jobs': 0,
+    'par_threshold': 10000,
+    'numpy': False,
+    'numeric': False,
+    'max_output': 0,
+    'output_buffer': 65536,
+    'profile': False,
+    'sample': 0,
+    'budget': 0,
+}
+
+
+def from_meta(meta):
+    """Converts the meta-commands found by the lexer to options.
+
+    Unknown meta-commands are ignored. A boolean option is enabled by its
+    meta-command without argument, other options take the argument converted
+    to the type of their default value.
+    """
+
+    options = {}
+    for name, arg in meta.items():
+        if name not in DEFAULTS:
+            continue
+
+        default = DEFAULTS[name]
+        if isinstance(default, bool):
+            if arg is not True and arg not in ('on', 'off'):
+                raise OptionError("meta-command '{}' takes no argument or on/off".format(name))
+            options[name] = arg is True or arg == 'on'
+        else:
+            if arg is True:
+                raise OptionError("meta-command '{}' requires an argument".format(name))
+            try:
+                options[name] = type(default)(arg)
+            except ValueError:
+                raise OptionError("invalid argument for meta-command '{}': '{}'".format(name, arg)) from None
+
+    return options
+
+
+def resolve(meta=None, overrides=None):
+    """Returns the full set of options, starting from the defaults, applying
+    the meta-commands and then the overrides. Overrides that are None are
+    considered unset."""
+
+    options = dict(DEFAULTS)
+    options.update(from_meta(meta or {}))
+
+    for name, value in (overrides or {}).items():
+        if name not in DEFAULTS:
+            raise OptionError("unknown option: '{}'".format(name))
+        if value is not None:
+            options[name] = value
+
+    return options
@@ -0,0 +1,73 @@
+class OutputLimitError(BaseException):
+    """Raised when a program exceeds its maximum output size.
+
+    This derives from BaseException rather than Exception so that it is not
+    swallowed by the error handling of Pyth's # (forever) blocks.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+    def __str__(self):
+        return 'output limit of {} bytes exceeded'.format(self.max_bytes)
+
+
+class OutputAborted(BaseException):
+    """Raised to stop a program when its output is no longer wanted."""
+
+
+class CallbackStream:
+    """A text stream passing everything written to it to a callback. If the
+    callback returns False, OutputAborted is raised to stop the program."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, s):
+        if self.callback(s) is False:
+            raise OutputAborted()
+
+    def flush(self):
+        pass
+
+
+class OutputSink:
+    """Collects the output of a program and writes it to a text stream in
+    large batches, while keeping count of the number of (UTF-8 encoded) bytes
+    written. If max_bytes is given, output up to max_bytes is written, after
+    which OutputLimitError is raised."""
+
+    def __init__(self, stream, max_bytes=None, buffer_size=65536):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        self.bytes_written = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, s):
+        n = len(s) if s.isascii() else len(s.encode('utf-8'))
+
+        if self.max_bytes is not None and self.bytes_written + n > self.max_bytes:
+            allowed = self.max_bytes - self.bytes_written
+            s = s.encode('utf-8')[:allowed].decode('utf-8', errors='ignore')
+            self._append(s, len(s.encode('utf-8')))
+            self.flush()
+            raise OutputLimitError(self.max_bytes)
+
+        self._append(s, n)
+
+    def _append(self, s, n):
+        self.bytes_written += n
+        self._buffer.append(s)
+        self._buffered += len(s)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            data = ''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self.stream.write(data)
+        self.stream.flush()
@@ -0,0 +1,163 @@
+import atexit
+import concurrent.futures
+import itertools
+import os
+
+from . import env
+
+
+# Candidates that are tried sequentially before starting any workers, so
+# searches that end quickly do not pay for the process pool.
+SEQUENTIAL_PROBE = 256
+
+# Blocks of candidates start small and grow up to this size.
+MAX_BLOCK_SIZE = 65536
+
+
+_pool = None
+_pool_jobs = 0
+
+
+def get_pool(jobs):
+    """Returns a process pool with the given number of workers, reusing the
+    previous one if possible."""
+    global _pool, _pool_jobs
+
+    if _pool is None or _pool_jobs != jobs:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+        _pool = concurrent.futures.ProcessPoolExecutor(jobs)
+        _pool_jobs = jobs
+
+    return _pool
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+
+
+# Worker side.
+_compiled = {}
+
+
+def compile_lambda(task_id, source, bindings):
+    """Rebuilds a lambda from its generated source inside a clean environment
+    with the given variables bound. Called in worker processes, which keep
+    the lambda of the latest task."""
+
+    key = (task_id, source)
+    if key not in _compiled:
+        _compiled.clear()
+        env.setup()
+        env.environment.update(bindings)
+        _compiled[key] = eval(source, env.environment)
+
+    return _compiled[key]
+
+
+def search_block(task_id, source, bindings, lo, hi):
+    """Returns (n, error) for the first n in [lo, hi) matching the lambda, or
+    (None, False) if there is none. If the lambda raises, error is True and
+    n is the candidate it raised on."""
+
+    func = compile_lambda(task_id, source, bindings)
+    for n in range(lo, hi):
+        try:
+            if func(env.Real(n)):
+                return n, False
+        except Exception:
+            return n, True
+
+    return None, False
+
+
+def map_block(task_id, source, bindings, items):
+    """Returns (results, None) with the lambda applied to every item, or
+    (None, i) if the lambda raises on item i. Called in worker processes."""
+
+    func = compile_lambda(task_id, source, bindings)
+    results = []
+    for i, item in enumerate(items):
+        try:
+            results.append(func(item))
+        except Exception:
+            return None, i
+
+    return results, None
+
+
+# Main side.
+_task_ids = itertools.count()
+
+
+def new_task_id():
+    return (os.getpid(), next(_task_ids))
+
+
+def first_match(start, func, source, bindings, jobs):
+    """Returns the first n >= start for which func(n) is truthy, exactly like
+    a sequential search would, by searching contiguous blocks of candidates
+    in parallel. On any error the search continues sequentially from the
+    candidate that failed, to reproduce the error (or result) exactly."""
+
+    n = start
+    for _ in range(SEQUENTIAL_PROBE):
+        if func(n):
+            return n
+        n += 1
+
+    pool = get_pool(jobs)
+    task_id = new_task_id()
+    pending = []
+    lo = int(n)
+    block_size = SEQUENTIAL_PROBE
+
+    def submit():
+        nonlocal lo, block_size
+        pending.append(pool.submit(search_block, task_id, source, bindings, lo, lo + block_size))
+        lo += block_size
+        block_size = min(2 * block_size, MAX_BLOCK_SIZE)
+
+    try:
+        for _ in range(2 * jobs):
+            submit()
+
+        # Blocks are consumed in order, so the first match found is the
+        # smallest one.
+        while True:
+            match, error = pending.pop(0).result()
+            if error:
+                return env.Pfilter(env.Real(match), func)
+            if match is not None:
+                return env.Real(match)
+            submit()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def map_chunks(seq, func, source, bindings, jobs):
+    """Returns [func(e) for e in seq], computed in chunks by worker processes
+    and reassembled in order. If func raises on any element, the mapping is
+    redone locally from the start of that chunk to reproduce the error."""
+
+    pool = get_pool(jobs)
+    task_id = new_task_id()
+    chunk_size = max(1, -(-len(seq) // (4 * jobs)))
+    chunks = [list(seq[i:i + chunk_size]) for i in range(0, len(seq), chunk_size)]
+    futures = [pool.submit(map_block, task_id, source, bindings, chunk) for chunk in chunks]
+
+    results = []
+    try:
+        for chunk, future in zip(chunks, futures):
+            chunk_results, error = future.result()
+            if error is not None:
+                chunk_results = [func(e) for e in chunk]
+            results.extend(chunk_results)
+    finally:
+        for future in futures:
+            future.cancel()
+
+    return results
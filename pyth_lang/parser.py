@@ -7,7 +7,7 @@
 # <.symbols>
 
 
-VARIABLES = ['a', 'b', 'c', 'd', 'e', 'v', 'w', 'x', 'y', 'z', 'V', '$a', '$q', '$A', '$Q']
+VARIABLES = ['a', 'b', 'c', 'd', 'e', 'v', 'w', 'x', 'y', 'z', 'V', '$a', '$l', '$q', '$A', '$Q']
 NO_AUTOPRINT = {'=', '~', 'p'}
 BLOCK_TOKS = '#BEFIW'
 INIT_FIRST_TIME = {'x', 'y', 'L'}
@@ -59,11 +59,14 @@ class ParserError(Exception):
 
 
 class ASTNode:
-    def __init__(self, type, data, args=None, children=None):
+    # pos is the offset of the node's token in the preprocessed source, or
+    # None if the node has no token.
+    def __init__(self, type, data, args=None, children=None, pos=None):
         self.type = type
         self.data = data
         self.args = args or []
         self.children = children or []
+        self.pos = pos
 
     def __repr__(self):
         return 'ASTNode({!r}, {!r}, {!r})'.format(self.type, self.data, self.args)
@@ -90,7 +93,7 @@ class Parser:
                 if self.should_init_var[tok.data] == 0:
                     self.should_init_var[tok.data] = 1
 
-            return ASTNode('lit', tok.data)
+            return ASTNode('lit', tok.data, pos=tok.pos)
 
         if tok.data in BLOCK_TOKS:
             raise ParserError(
@@ -99,12 +102,13 @@ class Parser:
             )
 
         if tok.data in '=~':
-            return self._parse_assign(tok.data)
+            return self._parse_assign(tok)
 
         if tok.data not in ARITIES:
             raise ParserError("symbol not implemented: '{}'".format(tok.data))
 
         data = tok.data
+        pos = tok.pos
         args = []
         arity = ARITIES[tok.data]
 
@@ -126,15 +130,17 @@ class Parser:
             args.append(self._parse_expr())
             arity -= 1
 
-        return ASTNode('expr', data, args)
+        return ASTNode('expr', data, args, pos=pos)
 
-    def _parse_assign(self, data):
+    def _parse_assign(self, tok):
+        data = tok.data
         assign_var = self.lex.get_token()
         if assign_var.type != 'symb':
             raise ParserError("expected symbol after '{}'".format(data))
 
         if assign_var.data in VARIABLES:
-            ast = ASTNode('expr', data, [ASTNode('lit', assign_var.data, []), self._parse_expr()])
+            ast = ASTNode('expr', data, [ASTNode('lit', assign_var.data, [], pos=assign_var.pos), self._parse_expr()],
+                          pos=tok.pos)
         else:
             start_tok = assign_var
             if start_tok.data not in ARITIES or ARITIES[start_tok.data] < 1:
@@ -145,7 +151,8 @@ class Parser:
             if assign_var.type != 'symb' or assign_var.data not in VARIABLES:
                 raise ParserError("expected variable after '{}{}'".format(data, start_tok.data))
 
-            ast = ASTNode('expr', data, [ASTNode('lit', assign_var.data, []), self._parse_expr(start_tok)])
+            ast = ASTNode('expr', data, [ASTNode('lit', assign_var.data, [], pos=assign_var.pos),
+                                         self._parse_expr(start_tok)], pos=tok.pos)
 
         if assign_var.data in 'vV':
             if self.should_init_var[assign_var.data] == 0:
@@ -157,7 +164,7 @@ class Parser:
         self.seen_init.add(tok.data)
         init_expr = self._parse_expr()
         actual_expr = self._parse_expr(tok)
-        return ASTNode('expr', 'init-' + tok.data, [init_expr] + actual_expr.args)
+        return ASTNode('expr', 'init-' + tok.data, [init_expr] + actual_expr.args, pos=tok.pos)
 
     def _parse_block(self, root=False):
         implicit_print = True
@@ -165,7 +172,7 @@ class Parser:
         if not root:
             block_tok = self.lex.get_token()
 
-        block = ASTNode('block', 'root' if root else block_tok.data)
+        block = ASTNode('block', 'root' if root else block_tok.data, pos=None if root else block_tok.pos)
 
         if block.data in 'IFW':
             block.args = [self._parse_expr()]
@@ -181,7 +188,7 @@ class Parser:
             # Handle break.
             elif tok.type == 'symb' and tok.data == 'B':
                 self.lex.get_token()
-                block.children.append((ASTNode('block', 'B'), False))
+                block.children.append((ASTNode('block', 'B', pos=tok.pos), False))
                 implicit_print = True
                 break
 
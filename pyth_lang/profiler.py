@@ -0,0 +1,151 @@
+# Deterministic profiling of Pyth programs.
+#
+# With the profile option enabled, Codegen emits every call to a builtin as
+# prof_call(func, name, offset, *args), with offset the position of the call
+# in the Pyth source. The profile times each call and aggregates calls by
+# builtin, type signature and source offset. The type signature is the first
+# issig pattern the builtin matched (issig is wrapped for the duration of
+# the run), or else the type codes of the arguments.
+#
+# Nothing of this is compiled in unless profiling is enabled.
+
+import json
+import time
+
+from . import env
+
+
+# At most this many calls are kept as individual trace events.
+MAX_EVENTS = 100000
+
+
+class Profile:
+    def __init__(self):
+        # (name, signature, offset) -> [calls, total time, own time]
+        self.stats = {}
+
+        # For every active call: [matched signature, time spent in calls].
+        self.stack = []
+
+        # (name, signature, offset, start, duration) of the first calls.
+        self.events = []
+        self.dropped_events = 0
+
+        self.start = time.perf_counter()
+        self.elapsed = None
+
+    def call(self, func, name, offset, *args):
+        frame = [None, 0.0]
+        self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+            signature = frame[0] or ''.join(map(type_code, args))
+            key = (name, signature, offset)
+            entry = self.stats.get(key)
+            if entry is None:
+                entry = self.stats[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += elapsed - frame[1]
+
+            if len(self.events) < MAX_EVENTS:
+                self.events.append((name, signature, offset, start, elapsed))
+            else:
+                self.dropped_events += 1
+
+    def wrap_issig(self, issig):
+        """Returns issig, recording the first pattern matched by the builtin
+        currently called."""
+        stack = self.stack
+
+        def profiled_issig(pattern, *objs):
+            result = issig(pattern, *objs)
+            if result and stack and stack[-1][0] is None:
+                stack[-1][0] = pattern
+            return result
+
+        return profiled_issig
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.start
+
+    def rows(self):
+        """Returns the statistics as dicts, sorted by own time."""
+        rows = [{'name': name, 'signature': signature, 'offset': offset,
+                 'calls': calls, 'total': total, 'own': own}
+                for (name, signature, offset), (calls, total, own) in self.stats.items()]
+        rows.sort(key=lambda row: row['own'], reverse=True)
+        return rows
+
+    def table(self, source=None, limit=None):
+        """Formats the statistics as a table. If the (original) source is
+        given, offsets are shown as line:column with the symbol there."""
+        lines = ['{:>10} {:>12} {:>12}  {:<20} {:<5} {}'.format(
+            'calls', 'total (ms)', 'own (ms)', 'builtin', 'sig', 'position')]
+
+        for row in self.rows()[:limit]:
+            lines.append('{:>10} {:>12.3f} {:>12.3f}  {:<20} {:<5} {}'.format(
+                row['calls'], 1000 * row['total'], 1000 * row['own'],
+                row['name'], row['signature'], format_position(row['offset'], source)))
+
+        if self.elapsed is not None:
+            lines.append('total run time: {:.3f} ms'.format(1000 * self.elapsed))
+
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return {'elapsed': self.elapsed, 'builtins': self.rows(),
+                'dropped_events': self.dropped_events}
+
+    def chrome_trace(self):
+        """Returns the individual calls in the Chrome trace event format."""
+        events = []
+        for name, signature, offset, start, elapsed in self.events:
+            events.append({'name': name, 'cat': 'builtin', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': 1e6 * (start - self.start), 'dur': 1e6 * elapsed,
+                           'args': {'signature': signature, 'offset': offset}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f)
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def type_code(obj):
+    """Returns the issig type code of obj."""
+    if obj is None:
+        return '_'
+    if env.isreal(obj):
+        return 'r'
+    if env.isstr(obj):
+        return 's'
+    if env.islist(obj):
+        return 'l'
+    if env.isseq(obj):
+        return 'q'
+    return 'a'
+
+
+def format_position(offset, source=None):
+    if offset is None:
+        return '?'
+    if source is None:
+        return str(offset)
+
+    line = source.count(b'\n', 0, offset) + 1
+    col = offset - (source.rfind(b'\n', 0, offset) + 1) + 1
+    symbol = source[offset:offset + 1].decode('utf-8', errors='replace')
+    if symbol == '.':
+        symbol = source[offset:offset + 2].decode('utf-8', errors='replace')
+    return '{}:{} {}'.format(line, col, symbol)
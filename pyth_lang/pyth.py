@@ -1,52 +1,335 @@
 import argparse
 import io
+import json
+import os
 import sys
 
 from .lexer import Lexer
 from .parser import Parser
 from .codegen import Codegen
+from .options import DEFAULTS, resolve
+from .output import OutputLimitError, OutputAborted, CallbackStream
+from .stats import Stats, count_nodes
 from . import env
 
 
 __version__ = '5.0preview0'
 
 
-def interpret(source):
-    lexer = Lexer(source)
-    parser = Parser(lexer)
-    codegen = Codegen(parser)
-    env.run(codegen.gen_code())
+def _compile(lexer, overrides, stats):
+    options = resolve(lexer.meta, overrides)
 
+    with stats.phase('tokenize'):
+        tokens = lexer.tokenize()
 
-def run_code(source, stdin=''):
+    with stats.phase('parse'):
+        parser = Parser(lexer)
+        codegen = Codegen(parser, options)
+
+    with stats.phase('codegen'):
+        code = codegen.gen_code()
+
+    stats.counts.update({
+        'source_bytes': len(lexer.original_src),
+        'preprocessed_bytes': len(lexer.preprocessed_source()),
+        'tokens': tokens,
+        'ast_nodes': count_nodes(codegen.ast),
+        'code_bytes': len(code),
+        'code_lines': code.count('\n') + 1,
+    })
+
+    return options, codegen, code
+
+
+def compile_source(source, stats=None, **overrides):
+    """Compiles source to Python. Returns the code, the options it was
+    compiled with and its source map. If given, the phases are measured in
+    stats."""
+    stats = stats or Stats(trace_memory=False)
+
+    with stats.phase('preprocess'):
+        lexer = Lexer(source)
+
+    options, codegen, code = _compile(lexer, overrides, stats)
+    return code, options, codegen.source_map
+
+
+def interpret(source, **overrides):
+    code, options, _ = compile_source(source, **overrides)
+    return env.run(code, options)
+
+
+def _run(source, stdin, stdout, report, overrides, stats=None):
     error = None
 
+    # Left over from the previous run, they would end up in the report if
+    # this one fails to compile.
+    env.output = env.profile = env.sampler = None
+
     try:
-        sys.stdout = io.StringIO()
+        sys.stdout = stdout
         sys.stdin = io.StringIO(stdin)
-        interpret(source.encode('utf-8'))
-    except SystemExit:
+        if stats is not None:
+            stats.start()
+        code, options, source_map = compile_source(source.encode('utf-8'), stats, **overrides)
+        if report is not None:
+            report['source_map'] = source_map
+        env.run(code, options, stats)
+    except (SystemExit, OutputAborted):
         pass
-    except Exception as e:
+    except (Exception, OutputLimitError, env.BudgetExceededError) as e:
         error = e
     finally:
-        result = sys.stdout.getvalue()
         sys.stdout = sys.__stdout__
         sys.stdin = sys.__stdin__
+        if stats is not None:
+            stats.stop()
+
+    if report is not None:
+        report['bytes_written'] = env.output.bytes_written if env.output else 0
+        if env.profile is not None:
+            report['profile'] = env.profile
+        if env.sampler is not None:
+            report['sampler'] = env.sampler
+        if stats is not None:
+            report['stats'] = stats.to_json()
+
+    return error
+
+
+def run_code(source, stdin='', report=None, stats=False, cache=None, **overrides):
+    """Runs source with the given stdin, returning the output and the
+    exception raised, if any. Options can be given as keyword arguments.
+
+    If report is a dict it is filled with information about the run:
+    'bytes_written', the number of bytes the program output, and
+    'source_map', the SourceMap of the generated code (if it compiled) and,
+    with the profile option, 'profile', the Profile of the run and with the
+    sample option, 'sampler', the Sampler of the run.
+
+    If stats is true, report also gets 'stats': the wall time, CPU time and
+    memory allocation of each phase of compiling and running the program,
+    and the sizes of its source, tokens, AST and generated code.
+
+    If cache is a ResultCache (see cache.py), the output of deterministic
+    programs is looked up in it before running them, and stored in it after
+    running them without error. A report or stats bypass the cache.
+    """
+    key = None
+    if cache is not None and report is None and not stats:
+        from .cache import result_key
+        key = result_key(source.encode('utf-8'), stdin, overrides)
+        output = None if key is None else cache.get(key)
+        if output is not None:
+            return output, None
+
+    stdout = io.StringIO()
+    error = _run(source, stdin, stdout, report, overrides, Stats() if stats else None)
+    if key is not None and error is None:
+        cache.put(key, stdout.getvalue())
+    return stdout.getvalue(), error
+
+
+def stream_code(source, callback, stdin='', report=None, **overrides):
+    """Like run_code, but passes the output to callback in chunks as soon as
+    it is written, instead of returning it. If callback returns False the
+    program is stopped. Returns the exception raised, if any.
 
-    return result, error
+    Unless given, the output_buffer option defaults to 0 here, such that
+    every write is passed on immediately.
+    """
+    overrides.setdefault('output_buffer', 0)
+    return _run(source, stdin, CallbackStream(callback), report, overrides)
+
+
+def judge_code(source, expected, stdin='', report=None, **overrides):
+    """Runs source and compares its output against expected while it runs,
+    stopping the program on the first difference. Once the expected output
+    is complete only newlines may follow, the output is accepted when the
+    program ends. Trailing newlines are ignored.
+
+    Returns (verdict, output, error), where verdict is 'accepted', 'wrong'
+    or 'error' (the program raised before its output was complete).
+    """
+    expected = expected.rstrip('\n')
+    output = []
+    state = {'pos': 0, 'wrong': False}
+
+    def compare(chunk):
+        output.append(chunk)
+        pos = state['pos']
+        if pos == len(expected):
+            # Only newlines may follow the expected output.
+            if chunk.strip('\n'):
+                state['wrong'] = True
+                return False
+            return True
+
+        if expected[pos:pos + len(chunk)] != chunk:
+            rest = chunk[len(expected) - pos:]
+            if not chunk.startswith(expected[pos:]) or rest.strip('\n'):
+                state['wrong'] = True
+                return False
+
+        state['pos'] = min(pos + len(chunk), len(expected))
+        return True
+
+    error = stream_code(source, compare, stdin, report, **overrides)
+    output = ''.join(output)
+
+    if state['wrong']:
+        verdict = 'wrong'
+    elif state['pos'] == len(expected):
+        verdict = 'accepted'
+    elif error is not None:
+        verdict = 'error'
+    else:
+        verdict = 'wrong'
+
+    return verdict, output, error
 
 
 def cli():
     argparser = argparse.ArgumentParser("pyth", description='Pyth interpreter.')
-    argparser.add_argument('file', help='Pyth file to run')
+    argparser.add_argument('file', nargs='?', help='Pyth file to run')
     argparser.add_argument("-d", dest="debug", action="store_true", help='Show trimmed input and generated code.')
     argparser.add_argument("-g", dest="gen_code", action="store_true", help='Only generate code.')
+    argparser.add_argument("-m", "--memo", dest="memo", action="store_const", const=True,
+                           help='Memoize L, and allow deep recursion (same as ;# memo).')
+    argparser.add_argument("--memo-size", dest="memo_size", type=int, metavar='N',
+                           help='Maximum number of memoized results of L.')
+    argparser.add_argument("-j", "--jobs", dest="jobs", type=int, metavar='N',
+                           help='Use N worker processes for f searches and m (same as ;# jobs N).')
+    argparser.add_argument("--par-threshold", dest="par_threshold", type=int, metavar='N',
+                           help='Only map sequences of at least N elements in parallel.')
+    argparser.add_argument("--numpy", dest="numpy", action="store_const", const=True,
+                           help='Vectorise operations on integer lists with NumPy (same as ;# numpy).')
+    argparser.add_argument("--numeric", dest="numeric", action="store_const", const=True,
+                           help='Evaluate irrational results to floating point right away (same as ;# numeric).')
+    argparser.add_argument("--max-output", dest="max_output", type=int, metavar='BYTES',
+                           help='Abort the program once it outputs more than BYTES bytes.')
+    argparser.add_argument("--budget", dest="budget", type=int, metavar='STEPS',
+                           help='Abort the program after STEPS loop iterations and lambda calls.')
+    argparser.add_argument("--source-map", dest="source_map", metavar='FILE',
+                           help='Write the source map of the generated code to FILE as JSON.')
+    argparser.add_argument("--profile", dest="profile", action="store_const", const=True,
+                           help='Time every call of a builtin and print a table to stderr (same as ;# profile).')
+    argparser.add_argument("--profile-json", dest="profile_json", metavar='FILE',
+                           help='Profile, and write the statistics to FILE as JSON.')
+    argparser.add_argument("--chrome-trace", dest="chrome_trace", metavar='FILE',
+                           help='Profile, and write the calls to FILE in the Chrome trace event format.')
+    argparser.add_argument("--sample", dest="sample", type=int, metavar='MS',
+                           help='Sample the stack every MS milliseconds (same as ;# sample MS).')
+    argparser.add_argument("--folded", dest="folded", metavar='FILE',
+                           help='Write the sampled stacks to FILE in the folded flame graph format '
+                                '(default: stderr). Implies --sample 10 if not given.')
+    argparser.add_argument("--stats", dest="stats", action="store_true",
+                           help='Print the time and memory used by each phase as JSON to stderr.')
+    argparser.add_argument("--compile", dest="compile", action="store_true",
+                           help='Compile to a standalone Python module instead of running.')
+    argparser.add_argument("-o", dest="output", metavar='FILE',
+                           help='Module file written by --compile (default: the input file with .py extension).')
+    argparser.add_argument("--cache", dest="cache", action="store_true",
+                           help='Look up the output of deterministic programs in the result cache and store it '
+                                'there (see cache.py). Reads all input up front.')
+    argparser.add_argument("--cache-size", dest="cache_size", type=int, default=64, metavar='MIB',
+                           help='Size limit of the result cache (default 64).')
+    argparser.add_argument("--cases", dest="cases", nargs='+', metavar='FILE',
+                           help='Run the program once for every FILE as stdin, compiling it only once.')
+    argparser.add_argument("--serve", dest="serve", metavar='ADDRESS',
+                           help='Run an evaluation service on a Unix socket path or [host:]port (see server.py).')
+    argparser.add_argument("--workers", dest="workers", type=int, metavar='N',
+                           help='Worker processes of --serve, or cases --cases runs at a time '
+                                '(default: the number of CPUs).')
+    argparser.add_argument("--queue", dest="queue", type=int, default=64, metavar='N',
+                           help='Requests --serve queues before rejecting them as busy (default 64).')
+    argparser.add_argument("--timeout", dest="timeout", type=float, default=10.0, metavar='SECONDS',
+                           help='Time limit per request of --serve (default 10).')
     argparser.set_defaults(debug=False)
     args = argparser.parse_args()
 
+    if args.serve:
+        import asyncio
+        from .server import serve, DEFAULT_MAX_OUTPUT
+        overrides = {name: getattr(args, name) for name in ('memo', 'memo_size', 'numpy', 'numeric')
+                     if getattr(args, name) is not None}
+        try:
+            asyncio.run(serve(args.serve, workers=args.workers, queue_size=args.queue,
+                              timeout=args.timeout, max_output=args.max_output or DEFAULT_MAX_OUTPUT,
+                              overrides=overrides))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.file is None:
+        argparser.error('the following arguments are required: file')
+
+    if args.compile:
+        from .aot import compile_file
+        output = args.output or os.path.splitext(args.file)[0] + '.py'
+        if os.path.abspath(output) == os.path.abspath(args.file):
+            argparser.error('the module would overwrite the input file, give -o')
+        compile_file(args.file, output, **{name: getattr(args, name, None) for name in DEFAULTS})
+        return
+
+    if args.cases:
+        from .batch import run_many
+        with open(args.file, 'rb') as source:
+            source = source.read().decode('utf-8')
+        stdins = []
+        for case in args.cases:
+            with open(case) as f:
+                stdins.append(f.read())
+
+        overrides = {name: getattr(args, name, None) for name in DEFAULTS}
+        failed = False
+        for case, (output, error) in zip(args.cases, run_many(source, stdins, args.workers, **overrides)):
+            print('==> {} <=='.format(case))
+            sys.stdout.write(output)
+            if error is not None:
+                sys.stdout.flush()
+                print('pyth: {}: {}: {}'.format(case, type(error).__name__, error), file=sys.stderr)
+                failed = True
+        sys.exit(1 if failed else 0)
+
     with open(args.file, 'rb') as source:
-        lexer = Lexer(source.read())
+        source = source.read()
+
+    use_cache = args.cache and not (args.debug or args.gen_code or args.source_map or args.stats
+                                    or args.profile_json or args.chrome_trace or args.folded)
+    if use_cache:
+        from .cache import ResultCache, cacheable
+        from .lexer import LexerError
+        from .options import OptionError
+        overrides = {name: getattr(args, name, None) for name in DEFAULTS}
+        try:
+            # Profiling and sampling, also through meta-commands, need a run.
+            use_cache = cacheable(resolve(Lexer(source).meta, overrides))
+        except (LexerError, OptionError):
+            # Reported by the normal run below.
+            use_cache = False
+
+    if use_cache:
+        with ResultCache(max_bytes=args.cache_size << 20) as cache:
+            output, error = run_code(source.decode('utf-8'), sys.stdin.read(),
+                                     cache=cache, **overrides)
+        sys.stdout.write(output)
+        if isinstance(error, (OutputLimitError, env.BudgetExceededError)):
+            sys.exit('pyth: ' + str(error))
+        if error is not None:
+            raise error
+        return
+
+    stats = Stats(trace_memory=args.stats)
+    stats.start()
+
+    with stats.phase('preprocess'):
+        lexer = Lexer(source)
+
+    if args.profile_json or args.chrome_trace:
+        args.profile = True
+    if args.folded and not args.sample:
+        args.sample = 10
 
     if args.debug:
         src = lexer.preprocessed_source()
@@ -54,9 +337,12 @@ def cli():
         print(src.decode(sys.stdout.encoding, errors='ignore'))
         print('='*50)
 
-    parser = Parser(lexer)
-    codegen = Codegen(parser)
-    code = codegen.gen_code()
+    overrides = {name: getattr(args, name, None) for name in DEFAULTS}
+    options, codegen, code = _compile(lexer, overrides, stats)
+
+    if args.source_map:
+        with open(args.source_map, 'w') as f:
+            json.dump({'file': args.file, 'mappings': codegen.source_map.to_json()}, f)
 
     if args.gen_code:
         print(code)
@@ -65,7 +351,32 @@ def cli():
         print('='*50)
 
     if not args.gen_code:
-        env.run(code)
+        try:
+            bytes_written = env.run(code, options, stats)
+        except (OutputLimitError, env.BudgetExceededError) as e:
+            sys.exit('pyth: ' + str(e))
+        finally:
+            if env.profile is not None:
+                sys.stdout.flush()
+                print(env.profile.table(source), file=sys.stderr)
+                if args.profile_json:
+                    env.profile.write_json(args.profile_json)
+                if args.chrome_trace:
+                    env.profile.write_chrome_trace(args.chrome_trace)
+            if env.sampler is not None:
+                sys.stdout.flush()
+                if args.folded:
+                    env.sampler.write_folded(args.folded, codegen.source_map, source)
+                else:
+                    print(env.sampler.folded(codegen.source_map, source), file=sys.stderr)
+            if args.stats:
+                stats.stop()
+                sys.stdout.flush()
+                print(json.dumps(stats.to_json(), indent=2), file=sys.stderr)
+
+        if args.debug:
+            print('='*50)
+            print('{} bytes written'.format(bytes_written))
 
 if __name__ == '__main__':
     cli()
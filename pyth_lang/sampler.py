@@ -0,0 +1,112 @@
+# Sampling profiling of Pyth programs.
+#
+# A background thread wakes up every interval and looks at the stack of the
+# thread running the program. Frames of the generated code (file name
+# '<pyth>') are recorded by their line and column, which the source map
+# turns into Pyth source offsets afterwards. Frames of builtins are recorded
+# by function name, and all other frames (sympy, the standard library) are
+# left out, so their time counts towards the builtin that called them.
+#
+# The program itself runs unmodified: the only cost is the sampling thread
+# taking the GIL briefly every interval, well under a percent at an interval
+# of 10 ms.
+
+import collections
+import sys
+import threading
+import time
+
+from . import env
+
+
+class Sampler:
+    def __init__(self, interval):
+        self.interval = interval
+
+        # Stacks (tuples of frames, outermost first) -> number of samples.
+        # A frame is ('pyth', line, column) or ('env', function name).
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+
+        self._positions = {}
+        self._thread = None
+        self._target = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts sampling the calling thread."""
+        self._target = threading.get_ident()
+        self._stopped.clear()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='pyth-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.elapsed += time.perf_counter() - self._start_time
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._sample(frame)
+
+    def _sample(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename == '<pyth>':
+                stack.append(('pyth', *self._position(code, frame.f_lasti)))
+            elif code.co_filename == env.__file__:
+                stack.append(('env', code.co_name))
+            frame = frame.f_back
+
+        # Leave out the runtime frames the program was started from.
+        while stack and stack[-1][0] == 'env':
+            stack.pop()
+
+        if stack:
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def _position(self, code, lasti):
+        positions = self._positions.get(code)
+        if positions is None:
+            positions = self._positions[code] = list(code.co_positions())
+
+        # Instructions are two bytes.
+        line, _, col, _ = positions[lasti // 2]
+        return line, col
+
+    def folded(self, source_map=None, source=None):
+        """Returns the stacks in the folded format of flame graph tools: a
+        line 'frame;frame;... count' per stack. Generated code frames are
+        shown as pyth:offset, with the symbol at that offset if the
+        (original) source is given."""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            frames = [self._label(frame, source_map, source) for frame in stack]
+            lines.append('{} {}'.format(';'.join(frames), count))
+        return '\n'.join(lines)
+
+    def _label(self, frame, source_map, source):
+        if frame[0] == 'env':
+            return frame[1]
+
+        _, line, col = frame
+        offset = source_map.lookup(line, col) if source_map is not None else None
+        if offset is None:
+            return 'pyth:{}:{}'.format(line, col)
+        if source is None:
+            return 'pyth:{}'.format(offset)
+
+        symbol = source[offset:offset + 1]
+        if symbol == b'.':
+            symbol = source[offset:offset + 2]
+        return 'pyth:{}:{}'.format(offset, symbol.decode('utf-8', errors='replace'))
+
+    def write_folded(self, path, source_map=None, source=None):
+        with open(path, 'w') as f:
+            f.write(self.folded(source_map, source) + '\n')
@@ -0,0 +1,336 @@
+# An evaluation service: runs Pyth programs on request, for example for an
+# online "try it" page.
+#
+# The server speaks newline-delimited JSON over a Unix socket or TCP port.
+# A request is
+#
+#     {"id": 1, "source": "...", "stdin": "...", "timeout": 5, "max_output": 1000}
+#
+# with everything but source optional, and is answered by
+#
+#     {"id": 1, "status": "ok", "output": "...", "error": null, "time": 0.012}
+#
+# where status is ok, error (the program raised), output_limit, timeout,
+# busy (the queue is full, try again later) or invalid (a malformed
+# request). Requests on a connection may be answered out of order. The
+# request {"id": 2, "stats": true} is answered with the queue depth, worker
+# usage, counters and latency percentiles.
+#
+# Programs run in a fixed number of worker processes, started ahead of time
+# with everything imported. Requests wait in a bounded queue for a free
+# worker; when it is full they are rejected as busy instead of piling up. A
+# worker running past the time limit is killed and replaced. Output is
+# limited with the max_output option of run_code.
+#
+# Start it with pyth --serve ADDRESS, where ADDRESS is a Unix socket path
+# (containing a /) or [host:]port.
+
+import asyncio
+import collections
+import json
+import math
+import os
+import signal
+import sys
+import time
+
+
+DEFAULT_MAX_OUTPUT = 1 << 20
+
+# Latency percentiles are computed over this many of the latest requests.
+LATENCY_WINDOW = 1000
+
+
+class Busy(Exception):
+    pass
+
+
+class Worker:
+    """A worker process, running run_code for one request at a time."""
+
+    def __init__(self, overrides):
+        self.overrides = overrides
+        self.process = None
+
+    async def start(self):
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = os.environ.get('PYTHONPATH')
+        env = dict(os.environ, PYTHONPATH=package_dir + (os.pathsep + path if path else ''))
+
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'pyth_lang.server', '--worker', json.dumps(self.overrides),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env)
+
+        # The worker reports when it has imported and warmed up everything.
+        ready = await self.process.stdout.readline()
+        if not ready:
+            raise RuntimeError('pyth worker failed to start')
+
+    async def run(self, job, timeout):
+        """Runs a job, returning the worker's reply. Raises TimeoutError
+        after timeout seconds, killing the worker."""
+        self.process.stdin.write(json.dumps(job).encode('utf-8') + b'\n')
+        try:
+            await self.process.stdin.drain()
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            await self.stop()
+            raise
+        if not line:
+            await self.stop()
+            raise RuntimeError('pyth worker died')
+        return json.loads(line.decode('utf-8'))
+
+    async def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        self.process = None
+
+
+class EvalServer:
+    def __init__(self, workers=None, queue_size=64, timeout=10.0, max_output=DEFAULT_MAX_OUTPUT,
+                 overrides=None):
+        self.workers = [Worker(overrides or {}) for _ in range(workers or os.cpu_count() or 1)]
+        self.queue = asyncio.Queue(queue_size)
+        self.timeout = timeout
+        self.max_output = max_output
+
+        self.busy_workers = 0
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.run_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self._tasks = []
+
+    async def start(self):
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        self._tasks = [asyncio.create_task(self._dispatch(worker)) for worker in self.workers]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+    def submit(self, job):
+        """Queues a job (see job). Returns a future of the response, or
+        raises Busy if the queue is full."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((job, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.counts['busy'] += 1
+            raise Busy() from None
+        return future
+
+    async def _dispatch(self, worker):
+        while True:
+            job, future, queued = await self.queue.get()
+            self.busy_workers += 1
+            try:
+                response = await self._run(worker, job)
+            finally:
+                self.busy_workers -= 1
+
+            self.counts[response['status']] += 1
+            self.latencies.append(time.perf_counter() - queued)
+            if not future.done():
+                future.set_result(response)
+
+            # Replace a killed worker only after answering.
+            while worker.process is None:
+                try:
+                    await worker.start()
+                except (OSError, RuntimeError) as e:
+                    print('pyth: restarting worker failed: {}'.format(e), file=sys.stderr)
+                    await worker.stop()
+                    await asyncio.sleep(1)
+
+    def job(self, request):
+        """Validates a run request, returning the job for a worker with the
+        limits applied. Raises ValueError for malformed requests."""
+        source, stdin = request.get('source'), request.get('stdin', '')
+        timeout, max_output = request.get('timeout'), request.get('max_output')
+        timeout = self.timeout if timeout is None else timeout
+        max_output = self.max_output if max_output is None else max_output
+
+        if not isinstance(source, str) or not isinstance(stdin, str):
+            raise ValueError('source and stdin must be strings')
+        if not isinstance(timeout, (int, float)) or not isinstance(max_output, int) \
+                or isinstance(timeout, bool) or isinstance(max_output, bool):
+            raise ValueError('timeout and max_output must be numbers')
+        if not math.isfinite(timeout) or timeout <= 0 or max_output <= 0:
+            raise ValueError('timeout and max_output must be positive')
+
+        return {'source': source, 'stdin': stdin, 'timeout': min(timeout, self.timeout),
+                'max_output': min(max_output, self.max_output)}
+
+    async def _run(self, worker, job):
+        start = time.perf_counter()
+        try:
+            reply = await worker.run(job, job['timeout'])
+        except asyncio.TimeoutError:
+            return {'status': 'timeout', 'output': '', 'time': time.perf_counter() - start,
+                    'error': 'time limit of {} s exceeded'.format(job['timeout'])}
+        except (OSError, RuntimeError, ValueError) as e:
+            await worker.stop()
+            return {'status': 'error', 'output': '', 'time': time.perf_counter() - start,
+                    'error': 'worker failed: {}'.format(e)}
+
+        elapsed = time.perf_counter() - start
+        self.run_times.append(elapsed)
+        return dict(reply, time=elapsed)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'workers': len(self.workers),
+            'busy_workers': self.busy_workers,
+            'counts': dict(self.counts),
+            'latency': percentiles(self.latencies),
+            'run_time': percentiles(self.run_times),
+        }
+
+    async def handle(self, reader, writer):
+        """Serves the requests of a connection."""
+        lock = asyncio.Lock()
+        pending = set()
+
+        async def reply(response):
+            async with lock:
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        async def answer(request_id, future):
+            await reply({'id': request_id, **await future})
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                request_id = None
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    if not isinstance(request, dict):
+                        raise ValueError('request is not an object')
+                    request_id = request.get('id')
+                    if request.get('stats'):
+                        await reply({'id': request_id, **self.stats()})
+                        continue
+                    job = self.job(request)
+                except ValueError as e:
+                    self.counts['invalid'] += 1
+                    await reply({'id': request_id, 'status': 'invalid', 'error': str(e)})
+                    continue
+
+                try:
+                    future = self.submit(job)
+                except Busy:
+                    await reply({'id': request_id, 'status': 'busy', 'error': 'queue full'})
+                    continue
+
+                task = asyncio.create_task(answer(request_id, future))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+                # Let idle workers take the request off the queue before
+                # reading the next one.
+                await asyncio.sleep(0)
+
+            await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def percentiles(samples):
+    """Returns the 50th, 90th and 99th percentile and maximum of samples."""
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def nearest_rank(p):
+        return samples[max(0, -(-len(samples) * p // 100) - 1)]
+
+    return {'p50': nearest_rank(50), 'p90': nearest_rank(90), 'p99': nearest_rank(99),
+            'max': samples[-1], 'samples': len(samples)}
+
+
+async def start_server(server, address):
+    """Starts serving on address, a Unix socket path (containing a /) or
+    [host:]port. Returns the asyncio server."""
+    if '/' in address:
+        return await asyncio.start_unix_server(server.handle, address)
+
+    host, _, port = address.rpartition(':')
+    return await asyncio.start_server(server.handle, host or '127.0.0.1', int(port))
+
+
+async def serve(address, **kwargs):
+    """Serves on address until SIGINT or SIGTERM."""
+    server = EvalServer(**kwargs)
+    await server.start()
+    listener = await start_server(server, address)
+    print('pyth: serving on {} with {} workers'.format(address, len(server.workers)), file=sys.stderr)
+
+    loop = asyncio.get_running_loop()
+    main = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, main.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    try:
+        async with listener:
+            await listener.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.stop()
+        if '/' in address and os.path.exists(address):
+            os.unlink(address)
+
+
+def worker_main(overrides):
+    """The loop of a worker process: runs requests read from stdin, writing
+    replies to the original stdout."""
+    from .output import OutputLimitError
+    from .pyth import run_code
+
+    # The server stops the workers, Ctrl-C in its terminal should not.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Nothing may write to the reply channel but this loop.
+    replies = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    run_code("+1 1")
+    replies.write(b'{"ready": true}\n')
+    replies.flush()
+
+    for line in sys.stdin.buffer:
+        job = json.loads(line.decode('utf-8'))
+        options = dict(overrides, max_output=job['max_output'])
+        output, error = run_code(job['source'], job['stdin'], **options)
+
+        if error is None:
+            status = 'ok'
+        elif isinstance(error, OutputLimitError):
+            status = 'output_limit'
+        else:
+            status = 'error'
+
+        reply = {'status': status, 'output': output,
+                 'error': None if error is None else '{}: {}'.format(type(error).__name__, error)}
+        replies.write(json.dumps(reply).encode('utf-8') + b'\n')
+        replies.flush()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        worker_main(json.loads(sys.argv[2]))
@@ -0,0 +1,78 @@
+# Source maps link positions in the generated Python code back to the Pyth
+# source. While generating code, Codegen puts a marker in front of the code of
+# every AST node, holding the node's offset in the preprocessed source. Once
+# the code is complete the markers are removed, and their line and column
+# recorded together with the offset in the original source.
+#
+# Markers can't clash with generated code: NUL and SOH never appear in it
+# literally, string literals are emitted through repr.
+
+import bisect
+import re
+
+
+MARKER = re.compile('\x00([0-9]+)\x01')
+
+
+def mark(pos):
+    """Returns the marker for an offset in the preprocessed source."""
+    return '\x00{}\x01'.format(pos)
+
+
+def strip(code):
+    """Returns code without markers."""
+    return MARKER.sub('', code)
+
+
+class SourceMap:
+    """Maps (line, column) positions in generated code to byte offsets in
+    the original Pyth source. Lines start at 1 and columns at 0, like in
+    Python code objects."""
+
+    def __init__(self, entries=()):
+        self.entries = sorted(entries)
+
+    @classmethod
+    def extract(cls, code, original_offset):
+        """Removes the markers from code. Returns the code and its source
+        map, with preprocessed offsets converted by original_offset."""
+        entries = []
+        lines = code.split('\n')
+        for linenr, line in enumerate(lines, 1):
+            if '\x00' not in line:
+                continue
+
+            pieces = MARKER.split(line)
+            col = len(pieces[0])
+            for i in range(1, len(pieces), 2):
+                entries.append((linenr, col, original_offset(int(pieces[i]))))
+                col += len(pieces[i + 1])
+
+            lines[linenr - 1] = ''.join(pieces[::2])
+
+        return '\n'.join(lines), cls(entries)
+
+    def lookup(self, line, col=None):
+        """Returns the Pyth offset for a position in the generated code, or
+        None if the line has no mapping. That is the offset of the last node
+        starting at or before col, or of the first node on the line if none
+        does (or col is None)."""
+        if col is not None:
+            i = bisect.bisect_right(self.entries, (line, col, float('inf')))
+            if i and self.entries[i - 1][0] == line:
+                return self.entries[i - 1][2]
+
+        i = bisect.bisect_left(self.entries, (line,))
+        if i < len(self.entries) and self.entries[i][0] == line:
+            return self.entries[i][2]
+
+        return None
+
+    def to_json(self):
+        return [list(entry) for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'SourceMap({!r})'.format(self.entries)
@@ -0,0 +1,74 @@
+# Telemetry of the compile and run pipeline: wall time, CPU time and memory
+# allocation of each phase, plus the size of what each phase produced.
+#
+# Memory is measured with tracemalloc, which slows Python down considerably,
+# so statistics are only gathered on request (--stats, or stats=True for
+# run_code).
+
+import contextlib
+import time
+import tracemalloc
+
+
+class Stats:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+
+        # Phase name -> {'wall', 'cpu', 'allocated', 'peak'}, in order.
+        self.phases = {}
+
+        # Sizes such as the number of tokens and AST nodes.
+        self.counts = {}
+
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measures the code run inside the with block as the phase name."""
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            result = {'wall': time.perf_counter() - start_wall,
+                      'cpu': time.process_time() - start_cpu}
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                result['allocated'] = current - start_memory
+                result['peak'] = peak - start_memory
+            self.phases[name] = result
+
+    def to_json(self):
+        total = {'wall': sum(phase['wall'] for phase in self.phases.values()),
+                 'cpu': sum(phase['cpu'] for phase in self.phases.values())}
+        if any('peak' in phase for phase in self.phases.values()):
+            total['peak'] = max(phase.get('peak', 0) for phase in self.phases.values())
+
+        return {'phases': self.phases, 'counts': self.counts, 'total': total}
+
+
+def count_nodes(node):
+    """Returns the number of nodes in an AST."""
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack += node.args
+        stack += [child for child, _ in node.children]
+    return count
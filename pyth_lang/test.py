@@ -2,6 +2,8 @@ import unittest
 import sys
 
 from . import pyth
+from .output import OutputLimitError
+from .codegen import EXPR_FUNC
 
 
 class PythAssertionError(AssertionError):
@@ -37,17 +39,24 @@ class PythTestBase:
             raise PythAssertionError(e, source, expected, stdin).with_traceback(orig_tb) from None
 
 
+def doc_tests(doc):
+    """Returns the (source, expected output) pairs in a PythTest docstring."""
+    actual_text = '\n'.join(line[4:] for line in doc.split('\n')[1:-1])
+    auto_tests = actual_text.split('\n---\n')
+
+    tests = []
+    for test in auto_tests:
+        source, *expected = test.split('\n')
+        tests.append((source, '\n'.join(expected)))
+    return tests
+
+
 class PythTest(type):
     def __new__(cls, name, bases, classdict):
         bases = bases + (unittest.TestCase, PythTestBase)
 
         if '__doc__' in classdict:
-            actual_text = '\n'.join(line[4:] for line in classdict['__doc__'].split('\n')[1:-1])
-            auto_tests = actual_text.split('\n---\n')
-
-            for testnr, test in enumerate(auto_tests):
-                source, *expected = test.split('\n')
-                expected = '\n'.join(expected)
+            for testnr, (source, expected) in enumerate(doc_tests(classdict['__doc__'])):
                 classdict['test{}'.format(testnr + 1)] = cls.gen_test(source, expected)
 
         return super().__new__(cls, name, bases, classdict)
@@ -251,6 +260,10 @@ class OneList(metaclass=PythTest):
     [[]]
     """
 
+    def test_deep(self):
+        self.assert_pyth("FU5000=w]w)l`w", "10002")
+        self.assert_pyth("FU5000=w]w)w", "[" * 5001 + "]" * 5001)
+
 
 # ,
 class Pair(metaclass=PythTest):
@@ -422,6 +435,15 @@ class Power(metaclass=PythTest):
     ^50 0
     1
     ---
+    ^7_1
+    0.14285714285714285714
+    ---
+    ^_3_21
+    -9.5599066359748043777e-11
+    ---
+    [.5^2_70
+    [0.5, 8.4703294725430033907e-22]
+    ---
     ^"bar"2
     ['bb', 'ba', 'br', 'ab', 'aa', 'ar', 'rb', 'ra', 'rr']
     ---
@@ -691,6 +713,11 @@ class Filter(metaclass=PythTest):
     10
     """
 
+    def test_parallel(self):
+        self.assert_pyth(";# jobs 2\n=z3f>*aa*z300000", "949")
+        self.assert_pyth(";# jobs 2\nfq.!a120", "5")
+        self.assert_pyth(";# jobs 2\nfU10<a5", "[0, 1, 2, 3, 4]")
+
 
 # g
 # h
@@ -726,6 +753,16 @@ class Len(metaclass=PythTest):
     3
     """
 
+    def test_big_literal(self):
+        self.assert_pyth("l`" + "7" * 5000, "5000")
+        self.assert_pyth("`" + "7" * 5000 + ".25", "7.7777777777777777778e+4999")
+
+    def test_numeric(self):
+        self.assert_pyth(";# numeric\nl8", "3")
+        self.assert_pyth(";# numeric\nl10", "3.3219280948873623479")
+        self.assert_pyth(";# numeric\n=z1FU60=z+zlha)z", "273.13293037027436697")
+        self.assert_pyth(";# numeric\n^4 .5", "2")
+
 
 # m
 class Map(metaclass=PythTest):
@@ -744,6 +781,20 @@ class Map(metaclass=PythTest):
     [0, 1, 2]
     """
 
+    def test_parallel(self):
+        self.assert_pyth(";# jobs 2\n;# par_threshold 2\n=z3mU5*za", "[0, 3, 6, 9, 12]")
+        self.assert_pyth(";# jobs 2\n;# par_threshold 2\nmU3pa", "012[0, 1, 2]")
+        self.assert_pyth(";# jobs 2\n;# par_threshold 2\nm[1 2 3)]m\"ab\"+ab", "[[['1a', '1b']], [['2a', '2b']], [['3a', '3b']]]")
+
+    def test_numpy(self):
+        self.assert_pyth(";# numpy\nmU5!-a2", "[0, 0, 1, 0, 0]")
+        self.assert_pyth(";# numpy\nm[1 0.5)*a2", "[2, 0, 1]")
+        self.assert_pyth(";# numpy\nm[1 2)*a*4611686018427387904 4", "[18446744073709551616, 36893488147419103232]")
+        self.assert_pyth(";# numpy\nf>*aa1000000", "1001")
+        self.assert_pyth(";# numpy\nfU10!q3a", "[0, 1, 2, 4, 5, 6, 7, 8, 9]")
+        self.assert_pyth(";# numpy\nsU100", "4950")
+        self.assert_pyth(";# numpy\nS[3 1 2)", "[1, 2, 3]")
+
 
 # n
 class NotEquals(metaclass=PythTest):
@@ -796,6 +847,24 @@ class Print(metaclass=PythTest):
     38
     """
 
+    def test_max_output(self):
+        report = {}
+        result, error = pyth.run_code('#p"ab"', max_output=11, report=report)
+        self.assertEqual(result, 'abababababa')
+        self.assertIsInstance(error, OutputLimitError)
+        self.assertEqual(report['bytes_written'], 11)
+
+        result, error = pyth.run_code(';# max_output 5\n#p"\u00e9"')
+        self.assertEqual(result, '\u00e9\u00e9')
+        self.assertIsInstance(error, OutputLimitError)
+
+    def test_report_compile_error(self):
+        pyth.run_code('"abc"', report={}, profile=True)
+        report = {}
+        result, error = pyth.run_code('(((', report=report)
+        self.assertIsNotNone(error)
+        self.assertEqual(report, {'bytes_written': 0})
+
 
 # q
 class Equals(metaclass=PythTest):
@@ -842,6 +911,9 @@ class Sum(metaclass=PythTest):
     s"01"
     1
     ---
+    l`s+"1"*"0"5000
+    5001
+    ---
     sU5
     10
     ---
@@ -1043,6 +1115,11 @@ class Lambda(metaclass=PythTest):
     92
     """
 
+    def test_memo(self):
+        self.assert_pyth(";# memo\nL?<a2a+LtaL-a2)L200", "280571172992510140037611932413038677189525")
+        self.assert_pyth(";# memo\nL?<a1 0hLta)L20000", "20000")
+        self.assert_pyth(";# memo_size 1\n;# memo\nL*a2)L3L[1 2)L3", "6\n[1, 2, 1, 2]\n6")
+
 
 # M
 # N
@@ -1103,6 +1180,26 @@ class VarInput(metaclass=PythTest):
         self.assert_pyth("=V30V", "30")
         self.assert_pyth("~+V30V", "50", "20")
         self.assert_pyth("Vv", "2\n1", "1\n2")
+        self.assert_pyth("V", "1", "1\n2\n")
+        self.assert_pyth("I0V)5", "5")
+        self.assert_pyth("I0v)~v5v", "5", "1")
+
+    def test_literal(self):
+        self.assert_pyth("V", "[1, [2, 3], 'a']", "[1, (2, 3), 'a']")
+        self.assert_pyth("hV", "1", "1, 2")
+        self.assert_pyth("*2V", "3", "1.5")
+        self.assert_pyth("lV", "100000", str(list(range(100000))))
+
+        result, error = pyth.run_code("V", "__import__('os')")
+        self.assertIsInstance(error, ValueError)
+
+    def test_literal_numbers(self):
+        self.assert_pyth("V", "inf", "1e400")
+        self.assert_pyth("V", "[1, -inf]", "[1, -1e999]")
+        self.assert_pyth("V", "[0, 0, 1.5]", "[00, 0, 01.5]")
+        for stdin in ("0123", "[0123]", "[1, 02, 3]", "-007"):
+            result, error = pyth.run_code("V", stdin)
+            self.assertIsInstance(error, ValueError)
 
 
 # W
@@ -1153,6 +1250,20 @@ class BinString(metaclass=PythTest):
     [116, 101, 115, 116, 92]
     """
 
+    def test_list(self):
+        self.assert_pyth('+1h."a"', "98")
+        self.assert_pyth('+."ab"[1', "[97, 98, 1]")
+        self.assert_pyth('+[1)."ab"', "[1, 97, 98]")
+        self.assert_pyth('q."a"[97', "1")
+        self.assert_pyth('}98."abc"', "1")
+        self.assert_pyth('_."ab"', "[98, 97]")
+        self.assert_pyth('m."ab"+1a', "[98, 99]")
+
+    def test_large(self):
+        data = "x" * 100000
+        self.assert_pyth('l."{}"'.format(data), "100000")
+        self.assert_pyth('s."{}"'.format(data), str(120 * 100000))
+
 
 # .\
 # .!
@@ -1166,6 +1277,9 @@ class Factorial(metaclass=PythTest):
     ---
     .!.5
     0.88622692545275801365
+    ---
+    l`.!5000
+    16326
     """
 
 
@@ -1301,6 +1415,17 @@ class AlphabetDollar(metaclass=PythTest):
     """
 
 
+# $l
+class StdinLines(metaclass=PythTest):
+    def test_lines(self):
+        self.assert_pyth('F$lp+"<"+a">"', "<x><y><z>", "x\ny\nz")
+        self.assert_pyth('v F$lp+"<"+a">"', "x\n<y><z>", "x\ny\nz")
+        self.assert_pyth('m$l+a"!"', "['1!', '2!']", "1\n2")
+        self.assert_pyth('m$la', "[]")
+        self.assert_pyth(';# jobs 2\n;# par_threshold 1\nm$l_a', "['ba', 'dc']", "ab\ncd")
+        self.assertEqual(pyth.run_code('m$l_a', 'ab\ncd\n', jobs=2), pyth.run_code('m$l_a', 'ab\ncd\n'))
+
+
 # $A
 class ALPHABET(metaclass=PythTest):
     r"""
@@ -1332,3 +1457,482 @@ class QWERTY(metaclass=PythTest):
     =$Q5$Q
     5
     """
+
+
+# API
+class StreamCode(metaclass=PythTest):
+    def test_chunks(self):
+        chunks = []
+        self.assertIsNone(pyth.stream_code("FU3a", chunks.append))
+        self.assertEqual(chunks, ['0', '\n', '1', '\n', '2', '\n'])
+
+    def test_stop(self):
+        chunks = []
+        self.assertIsNone(pyth.stream_code('#p"x"', lambda c: chunks.append(c) or len(chunks) < 5))
+        self.assertEqual(chunks, ['x'] * 5)
+
+
+class JudgeCode(metaclass=PythTest):
+    def test_verdicts(self):
+        self.assertEqual(pyth.judge_code("FU3a", "0\n1\n2")[:2], ('accepted', '0\n1\n2\n'))
+        self.assertEqual(pyth.judge_code("FU3a", "0\n1\n3")[:2], ('wrong', '0\n1\n2'))
+        self.assertEqual(pyth.judge_code("FU3a", "0\n1\n2\n3")[:2], ('wrong', '0\n1\n2\n'))
+        self.assertEqual(pyth.judge_code("1h[", "1\n2")[0], 'error')
+
+    def test_early_termination(self):
+        self.assertEqual(pyth.judge_code('#p"ab"', "ababab")[:2], ('wrong', 'abababab'))
+        self.assertEqual(pyth.judge_code('#p"ab"', "abba")[:2], ('wrong', 'abab'))
+
+    def test_extra_output(self):
+        self.assertEqual(pyth.judge_code("1\n2", "1")[:2], ('wrong', '1\n2'))
+        self.assertEqual(pyth.judge_code('1p"\n\n"', "1")[:2], ('accepted', '1\n\n\n'))
+        self.assertEqual(pyth.judge_code("FU3a", "0\n1")[:2], ('wrong', '0\n1\n2'))
+
+
+class SourceMap(metaclass=PythTest):
+    def test_offsets(self):
+        source = '  ; comment\n  p+1 2\nFU2\n  a'
+        code, _, source_map = pyth.compile_source(source.encode('utf-8'))
+        lines = code.split('\n')
+
+        for line, col, offset in source_map.entries:
+            generated = lines[line - 1][col:]
+            if source[offset] in '+p':
+                self.assertTrue(generated.startswith(EXPR_FUNC[source[offset]]))
+            if source[offset] == 'F':
+                self.assertTrue(generated.startswith('for'))
+
+        self.assertEqual(source[source_map.lookup(1, 0)], 'p')
+        self.assertEqual(source[source_map.lookup(1, 7)], '+')
+        self.assertEqual(source[source_map.lookup(2)], 'F')
+
+    def test_report(self):
+        report = {}
+        pyth.run_code("1", report=report)
+        self.assertEqual(report['source_map'].entries, [(1, 10, 0)])
+
+
+class Profile(metaclass=PythTest):
+    def test_profile(self):
+        report = {}
+        self.assertEqual(pyth.run_code("FU10 =z+z1)z", report=report, profile=True), ('10\n', None))
+        rows = {(row['name'], row['signature']): row for row in report['profile'].rows()}
+        self.assertEqual(rows['plus', 'rr']['calls'], 10)
+        self.assertEqual(rows['plus', 'rr']['offset'], 7)
+        self.assertEqual(rows['unary_range', 'r']['calls'], 1)
+
+    def test_disabled(self):
+        code, _, _ = pyth.compile_source(b"FU10=z+z1")
+        self.assertNotIn('prof_call', code)
+        code, _, _ = pyth.compile_source(b";# profile\nFU10=z+z1")
+        self.assertIn('prof_call', code)
+
+
+class Sampler(metaclass=PythTest):
+    def test_sample(self):
+        report = {}
+        result = pyth.run_code("FU20000 =z+z*a3)z", report=report, sample=1)
+        self.assertEqual(result, ('599970000\n', None))
+
+        sampler = report['sampler']
+        self.assertGreater(sampler.samples, 0)
+        folded = sampler.folded(report['source_map'], b"FU20000 =z+z*a3)z")
+        self.assertTrue(all(line.startswith('pyth:') for line in folded.split('\n')))
+
+
+class Stats(metaclass=PythTest):
+    def test_stats(self):
+        report = {}
+        self.assertEqual(pyth.run_code("FU5 =z+z*a3)z", report=report, stats=True), ('30\n', None))
+
+        stats = report['stats']
+        self.assertEqual(list(stats['phases']),
+                         ['preprocess', 'tokenize', 'parse', 'codegen', 'setup', 'compile', 'execute'])
+        self.assertTrue(all(phase['peak'] >= 0 for phase in stats['phases'].values()))
+        self.assertEqual(stats['counts']['tokens'], 13)
+        self.assertEqual(stats['counts']['source_bytes'], 13)
+
+
+class Bench(metaclass=PythTest):
+    def test_welch(self):
+        from . import bench
+        self.assertAlmostEqual(bench.betainc(2, 3, 0.4), 0.5248)
+        t, df, p = bench.welch([1, 2, 3, 4, 5], [2, 3, 4, 5, 6])
+        self.assertEqual((t, df), (1.0, 8.0))
+        self.assertAlmostEqual(p, 0.3466, places=4)
+
+    def test_compare(self):
+        from . import bench
+        programs = {name: program for name, program in bench.corpus().items()
+                    if name in ('Zero.1', 'loop-sum')}
+        self.assertEqual(len(programs), 2)
+
+        results = bench.run_benchmarks(programs, repeat=3, warmup=0)
+        self.assertEqual(len(results['loop-sum']['execute']), 3)
+        baseline = bench.make_baseline({'loop-sum': {'total': [1.0, 1.01, 0.99]},
+                                        'Zero.1': {'total': [1.0, 1.01, 0.99]}}, 3)
+        slower = {'loop-sum': {'total': [2.0, 2.01, 1.99]}, 'Zero.1': {'total': [1.0, 0.99, 1.01]}}
+        verdicts = {(row[0], row[1]): row[6] for row in bench.compare(baseline, slower)}
+        self.assertEqual(verdicts['Zero.1', 'total'], '')
+        self.assertEqual(verdicts['loop-sum', 'total'], 'slower')
+
+
+class Microbench(metaclass=PythTest):
+    def test_overloads(self):
+        from . import microbench
+        overloads = microbench.overloads()
+        self.assertIn(('+', 'plus', 'rr'), overloads)
+        self.assertIn(('_', 'neg', 'q'), overloads)
+        self.assertIn(('`', 'Prepr', 'a'), overloads)
+        self.assertNotIn('L', [name for _, name, _ in overloads])
+
+    def test_fit(self):
+        from . import microbench
+        self.assertAlmostEqual(microbench.fit_exponent([(n, 3 * n * n) for n in (4, 16, 64)]), 2.0)
+        self.assertIsNone(microbench.fit_exponent([(4, 1.0)]))
+
+        results = microbench.run_matrix('^_ neg', max_size=256, min_time=0.001)
+        self.assertEqual([result['signature'] for result in results], ['r', 'q'])
+        self.assertEqual(results[1]['sizes'], [1, 4, 16, 64, 256])
+
+
+class CompileModule(metaclass=PythTest):
+    def load(self, source, **overrides):
+        import importlib.util
+        import os
+        import tempfile
+        from . import aot
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.py')
+            with open(path, 'w') as f:
+                f.write(aot.compile_module(source.encode('utf-8'), **overrides))
+            spec = importlib.util.spec_from_file_location('program', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        return module
+
+    def test_same_output(self):
+        programs = [("=z0FU200 =z+z*a3)z", ""), ("#=z+z1 p\"x\"Bz", ""), ("lV", "[1, 2, 3]"),
+                    ("V", "5"), (";# memo\nL?<a2a+LtaL-a2)L200", ""), ("m+1aU3", ""), ("", "")]
+        for source, stdin in programs:
+            module = self.load(source)
+            expected, _ = pyth.run_code(source, stdin)
+            self.assertEqual(module.main(stdin), expected)
+            # Every run starts from the initial state.
+            self.assertEqual(module.main(stdin), expected)
+
+    def test_options(self):
+        module = self.load("U100", max_output=10)
+        self.assertEqual(module.OPTIONS['max_output'], 10)
+        self.assertRaises(OutputLimitError, module.main)
+
+    def test_control_characters(self):
+        for source in ['"a"\rp"b"', '"a\0b"', '"a\x0bb"\r\n"c"', '"\x1cx\x85\u2028"']:
+            module = self.load(source)
+            self.assertEqual(module.main(), pyth.run_code(source)[0])
+
+
+@unittest.skipUnless(hasattr(__import__('os'), 'fork'), 'needs fork')
+class ForkServer(metaclass=PythTest):
+    def client(self, env, *args, stdin=''):
+        import subprocess
+        return subprocess.run([sys.executable, '-m', 'pyth_lang.client'] + list(args), input=stdin,
+                              capture_output=True, text=True, env=env, timeout=60)
+
+    def test_daemon(self):
+        import json
+        import os
+        import subprocess
+        import tempfile
+        import time
+        from . import client
+
+        with tempfile.TemporaryDirectory() as directory:
+            package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env = dict(os.environ, PYTH_SOCKET=os.path.join(directory, 'pyth.sock'),
+                       PYTHONPATH=package_dir)
+            with open(os.path.join(directory, 'prog.pyth'), 'w') as f:
+                f.write('lV')
+            with open(os.path.join(directory, 'range.pyth'), 'w') as f:
+                f.write('U100')
+
+            # Without a daemon the client runs the program itself.
+            result = self.client(env, os.path.join(directory, 'prog.pyth'), stdin='[1, 2]\n')
+            self.assertEqual((result.stdout, result.returncode), ('2\n', 0))
+
+            server = subprocess.Popen([sys.executable, '-m', 'pyth_lang.forkserver'], env=env)
+            try:
+                deadline = time.time() + 60
+                sock = client.connect(env['PYTH_SOCKET'])
+                while sock is None and time.time() < deadline:
+                    time.sleep(0.05)
+                    sock = client.connect(env['PYTH_SOCKET'])
+
+                # The run happens in a child of the daemon.
+                stdin_r, stdin_w = os.pipe()
+                stdout_r, stdout_w = os.pipe()
+                os.write(stdin_w, b'[1, 2, 3]\n')
+                os.close(stdin_w)
+                with sock, open(stdout_r, 'rb') as stdout:
+                    client.send_request(sock, {'argv': ['prog.pyth'], 'cwd': directory},
+                                        [stdin_r, stdout_w, 2])
+                    os.close(stdin_r)
+                    os.close(stdout_w)
+                    with sock.makefile('rb') as replies:
+                        replies = [json.loads(line) for line in replies]
+                    self.assertEqual(stdout.read(), b'3\n')
+                self.assertNotIn(replies[0]['pid'], (os.getpid(), server.pid))
+                self.assertEqual(replies[1], {'status': 0})
+
+                result = self.client(env, os.path.join(directory, 'prog.pyth'), stdin='[1, 2, 3]\n')
+                self.assertEqual((result.stdout, result.returncode), ('3\n', 0))
+
+                result = self.client(env, '--max-output', '5', os.path.join(directory, 'range.pyth'))
+                self.assertEqual((result.stdout, result.returncode), ('[0, 1', 1))
+                self.assertIn('output limit', result.stderr)
+
+                result = self.client(env, os.path.join(directory, 'missing.pyth'))
+                self.assertEqual(result.returncode, 1)
+                self.assertIn('FileNotFoundError', result.stderr)
+            finally:
+                server.terminate()
+                server.wait(60)
+
+            self.assertFalse(os.path.exists(env['PYTH_SOCKET']))
+
+    def test_early_signal(self):
+        import json
+        import os
+        import signal
+        import socket
+        import subprocess
+        import threading
+        import time
+        from . import client
+
+        ours, theirs = socket.socketpair()
+        handlers = {name: signal.getsignal(getattr(signal, name)) for name in client.FORWARDED_SIGNALS}
+
+        def daemon():
+            with theirs:
+                _, fds = client.receive_request(theirs)
+                for fd in fds:
+                    os.close(fd)
+                while signal.getsignal(signal.SIGTERM) == handlers['SIGTERM']:
+                    time.sleep(0.01)
+
+                # A signal that arrives before the pid of the child is known.
+                os.kill(os.getpid(), signal.SIGTERM)
+                child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+                theirs.sendall(json.dumps({'pid': child.pid}).encode('utf-8') + b'\n')
+                child.wait()
+                theirs.sendall(json.dumps({'status': child.returncode}).encode('utf-8') + b'\n')
+
+        thread = threading.Thread(target=daemon)
+        thread.start()
+        try:
+            with ours:
+                self.assertEqual(client.run(ours, []), -signal.SIGTERM)
+        finally:
+            thread.join()
+            for name, handler in handlers.items():
+                signal.signal(getattr(signal, name), handler)
+
+
+class Server(metaclass=PythTest):
+    def test_serve(self):
+        import asyncio
+        import json
+        import os
+        import tempfile
+        from . import server
+
+        async def session(path):
+            evaluator = server.EvalServer(workers=1, queue_size=1, timeout=0.5, max_output=5)
+            await evaluator.start()
+            listener = await server.start_server(evaluator, path)
+            reader, writer = await asyncio.open_unix_connection(path)
+
+            async def send(*requests):
+                for request in requests:
+                    writer.write(json.dumps(request).encode('utf-8') + b'\n')
+                await writer.drain()
+
+            async def receive(n):
+                replies = [json.loads(await reader.readline()) for _ in range(n)]
+                return {reply['id']: reply for reply in replies}
+
+            try:
+                await send({'id': 1, 'source': '# 1', 'timeout': 10})
+                while evaluator.busy_workers == 0:
+                    await asyncio.sleep(0.01)
+
+                await send({'id': 2, 'source': 'lV', 'stdin': '[1, 2]'}, {'id': 3, 'source': '1'},
+                           {'id': 4, 'stats': True}, {'id': 5, 'source': 5})
+                replies = await receive(5)
+                self.assertEqual(replies[1]['status'], 'timeout')
+                self.assertEqual((replies[2]['status'], replies[2]['output']), ('ok', '2\n'))
+                self.assertEqual(replies[3]['status'], 'busy')
+                self.assertEqual((replies[4]['queue_depth'], replies[4]['busy_workers']), (1, 1))
+                self.assertEqual(replies[5]['status'], 'invalid')
+
+                await send({'id': 6, 'source': 'U100'}, {'id': 7, 'stats': True})
+                replies = await receive(1)
+                self.assertEqual(replies[7]['counts'], {'timeout': 1, 'ok': 1, 'busy': 1, 'invalid': 1})
+                self.assertEqual(replies[7]['latency']['samples'], 2)
+                replies = await receive(1)
+                self.assertEqual((replies[6]['status'], replies[6]['output']), ('output_limit', '[0, 1'))
+            finally:
+                writer.close()
+                listener.close()
+                await evaluator.stop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(session(os.path.join(directory, 'pyth.sock')))
+
+    def test_limits(self):
+        from . import server
+        evaluator = server.EvalServer(workers=1, timeout=0.5, max_output=5)
+        self.assertEqual(evaluator.job({'source': '1', 'timeout': 0.1, 'max_output': 100}),
+                         {'source': '1', 'stdin': '', 'timeout': 0.1, 'max_output': 5})
+        self.assertEqual(evaluator.job({'source': '1', 'timeout': None})['timeout'], 0.5)
+        for limits in [{'timeout': 0}, {'timeout': -1}, {'timeout': float('nan')}, {'timeout': float('inf')},
+                       {'timeout': True}, {'timeout': '1'}, {'max_output': 0}, {'max_output': -5},
+                       {'max_output': False}, {'max_output': 1.5}]:
+            self.assertRaises(ValueError, evaluator.job, dict(source='1', **limits))
+
+
+class RunMany(metaclass=PythTest):
+    def test_sequential(self):
+        from .batch import run_many
+        from .literal import LiteralError
+        results = run_many('=z+zhVz', ['1', '2', 'x'], workers=1)
+        self.assertEqual([output for output, _ in results], ['2\n', '3\n', ''])
+        self.assertEqual([type(error) for _, error in results], [type(None), type(None), LiteralError])
+
+    @unittest.skipUnless(hasattr(__import__('os'), 'fork'), 'needs fork')
+    def test_forked(self):
+        from .batch import run_many
+        stdins = [str(i) for i in range(10)] + ['x']
+        expected = [pyth.run_code('=z+zhVz', stdin) for stdin in stdins]
+        results = run_many('=z+zhVz', stdins, workers=3)
+        self.assertEqual([output for output, _ in results], [output for output, _ in expected])
+        self.assertEqual([type(error) for _, error in results], [type(error) for _, error in expected])
+
+        results = run_many(';# max_output 3\n#1', ['', ''], workers=2)
+        self.assertEqual([output for output, _ in results], ['1\n1', '1\n1'])
+        self.assertIsInstance(results[0][1], OutputLimitError)
+
+    def test_compile_error(self):
+        from .batch import run_many
+        from .parser import ParserError
+        results = run_many('.(', ['1', '2'])
+        self.assertEqual([output for output, _ in results], ['', ''])
+        self.assertIsInstance(results[1][1], ParserError)
+
+    def test_portable(self):
+        from .batch import portable, CaseError
+
+        class Local(Exception):
+            pass
+
+        self.assertIsInstance(portable(ValueError('x')), ValueError)
+        error = portable(Local('x'))
+        self.assertIsInstance(error, CaseError)
+        self.assertEqual(str(error), 'Local: x')
+
+
+class ResultCache(metaclass=PythTest):
+    def test_run_code(self):
+        import os
+        import tempfile
+        from .cache import ResultCache, result_key
+
+        with tempfile.TemporaryDirectory() as directory:
+            with ResultCache(os.path.join(directory, 'cache.sqlite3')) as cache:
+                self.assertEqual(pyth.run_code('hV', '1', cache=cache), ('2\n', None))
+                self.assertEqual(pyth.run_code('hV', '1', cache=cache), ('2\n', None))
+                self.assertEqual(pyth.run_code('hV', '2', cache=cache), ('3\n', None))
+                self.assertIsInstance(pyth.run_code('hV', '1', cache=cache, max_output=1)[1], OutputLimitError)
+                self.assertIsInstance(pyth.run_code('hV', 'x', cache=cache)[1], Exception)
+                self.assertIsInstance(pyth.run_code('hV', 'x', cache=cache)[1], Exception)
+                stats = cache.stats()
+                self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 5, 2))
+
+                # The cached output is returned as is.
+                cache.put(result_key(b'hV', '1'), 'cached\n')
+                self.assertEqual(pyth.run_code('hV', '1', cache=cache), ('cached\n', None))
+
+                # Profiled programs always run.
+                report = {}
+                pyth.run_code(';# profile\nhV', '1', report=report, cache=cache)
+                self.assertIn('profile', report)
+                self.assertEqual(pyth.run_code(';# profile\nhV', '1', cache=cache), ('2\n', None))
+                self.assertEqual(pyth.run_code(';# profile\nhV', '1', cache=cache), ('2\n', None))
+                self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_eviction(self):
+        import os
+        import tempfile
+        from .cache import ResultCache
+
+        with tempfile.TemporaryDirectory() as directory:
+            with ResultCache(os.path.join(directory, 'cache.sqlite3'), max_bytes=30) as cache:
+                cache.put('a', 'x' * 9)
+                cache.put('b', 'x' * 9)
+                cache.put('c', 'x' * 9)
+                self.assertEqual(cache.get('a'), 'x' * 9)
+                cache.put('d', 'x' * 9)
+                self.assertEqual([cache.get(key) is not None for key in 'abcd'], [True, False, True, True])
+                cache.put('e', 'x' * 40)
+                self.assertIsNone(cache.get('e'))
+                self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_key(self):
+        from .cache import result_key
+        self.assertEqual(result_key(b'hV', '1'), result_key(b'hV', '1', {'memo': None}))
+        self.assertNotEqual(result_key(b'hV', '1'), result_key(b'hV', '2'))
+        self.assertNotEqual(result_key(b'hV', '1'), result_key(b'hV', '1', {'memo': True}))
+        self.assertNotEqual(result_key(b'hV', '1'), result_key(b'tV', '1'))
+        self.assertIsNone(result_key(b'hV', '1', {'profile': True}))
+        self.assertIsNone(result_key(b';# sample 1\nhV', '1'))
+
+
+class Budget(metaclass=PythTest):
+    def test_loops(self):
+        from .env import BudgetExceededError
+        output, error = pyth.run_code('#1', budget=10)
+        self.assertEqual(output, '1\n' * 10)
+        self.assertIsInstance(error, BudgetExceededError)
+        self.assertEqual(str(error), 'step budget of 10 exceeded')
+
+        self.assertIsInstance(pyth.run_code('# 1', budget=1000)[1], BudgetExceededError)
+        self.assertIsInstance(pyth.run_code(';# budget 5\nW1 1')[1], BudgetExceededError)
+        self.assertEqual(pyth.run_code('FU5 1)2', budget=5), ('2\n', None))
+        self.assertIsInstance(pyth.run_code('FU6 1)2', budget=5)[1], BudgetExceededError)
+
+    def test_lambdas(self):
+        from .env import BudgetExceededError
+        self.assertEqual(pyth.run_code('f>a3', budget=4), ('4\n', None))
+        self.assertIsInstance(pyth.run_code('f>a30000', budget=100)[1], BudgetExceededError)
+        self.assertEqual(pyth.run_code('mU3*a2', budget=3), ('[0, 2, 4]\n', None))
+        self.assertIsInstance(pyth.run_code('mU4*a2', budget=3)[1], BudgetExceededError)
+        self.assertIsInstance(pyth.run_code('oU4_a', budget=3)[1], BudgetExceededError)
+        self.assertEqual(pyth.run_code(';# memo\nL?<a2a+LtaL-a2)L20', budget=21), ('6765\n', None))
+        self.assertIsInstance(pyth.run_code('L?<a2a+LtaL-a2)L20', budget=1000)[1], BudgetExceededError)
+
+    def test_codegen(self):
+        code, _, _ = pyth.compile_source(b'FU3 1)mU5*a2')
+        self.assertNotIn('tick', code)
+        code, _, _ = pyth.compile_source(b'mU5*a2', jobs=2, budget=10)
+        self.assertIn('tick', code)
+        self.assertNotIn('parallel', code)
+
+    def test_numpy(self):
+        from .env import BudgetExceededError
+        self.assertIsInstance(pyth.run_code('f>a50000', budget=10, numpy=True)[1], BudgetExceededError)
+        self.assertIsInstance(pyth.run_code('mU100*a2', budget=10, numpy=True)[1], BudgetExceededError)
+        self.assertEqual(pyth.run_code('mU3*a2', budget=3, numpy=True), ('[0, 2, 4]\n', None))
+        code, _, _ = pyth.compile_source(b'mU5*a2', numpy=True, budget=10)
+        self.assertNotIn('vector', code)
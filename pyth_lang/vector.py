@@ -0,0 +1,183 @@
+# Vectorised evaluation of numeric list operations using NumPy, if available.
+#
+# Pyth values are unchanged: lists stay lists of exact reals. A list (or
+# range) of integers is converted to an int64 array, operated on as a whole
+# and converted back. Everything here returns None if it can't be done
+# exactly - NumPy isn't installed, an element isn't an integer, or an
+# intermediate result could overflow - and the caller then falls back to the
+# regular exact implementation.
+
+import sympy as sym
+
+
+# Largest magnitude allowed for array elements and intermediate results.
+# Anything below this can be added or subtracted without int64 overflow.
+LIMIT = 2**62
+
+_numpy = None
+
+
+def numpy():
+    """Returns the numpy module, or None if it isn't installed. NumPy is only
+    imported on first use, so programs that never vectorise don't pay for
+    importing it."""
+    global _numpy
+
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+
+    return _numpy or None
+
+
+class _Overflow(Exception):
+    pass
+
+
+def to_array(a):
+    """Converts a list of integers or an integer range to an int64 array."""
+    np = numpy()
+    if np is None:
+        return None
+
+    if isinstance(a, sym.Range):
+        if not (abs(a.start) < LIMIT and abs(a.stop) < LIMIT):
+            return None
+        return np.arange(int(a.start), int(a.stop), int(a.step), dtype=np.int64)
+
+    if not isinstance(a, list) or not all(isinstance(e, sym.Integer) for e in a):
+        return None
+
+    try:
+        arr = np.array([int(e) for e in a], dtype=np.int64)
+    except OverflowError:
+        return None
+
+    if len(arr) and not _small(arr):
+        return None
+
+    return arr
+
+
+def from_array(arr):
+    return [sym.Integer(e) for e in arr.tolist()]
+
+
+def _small(arr):
+    return max(-int(arr.min()), int(arr.max())) < LIMIT
+
+
+def _bound(arr):
+    arr = numpy().asarray(arr)
+    if not arr.size:
+        return 0
+    return max(-int(arr.min()), int(arr.max()))
+
+
+def evaluate(tree, x):
+    """Evaluates an expression tree (see Codegen._vector_tree) with x as the
+    lambda variable. Raises _Overflow if an intermediate result could exceed
+    LIMIT."""
+    np = numpy()
+
+    if isinstance(tree, int):
+        if abs(tree) >= LIMIT:
+            raise _Overflow()
+        return tree
+
+    if tree == 'x':
+        return x
+
+    op, *args = tree
+    args = [evaluate(arg, x) for arg in args]
+
+    if op == '_':
+        return -args[0]
+
+    if op == '!':
+        return (np.asarray(args[0]) == 0).astype(np.int64)
+
+    a, b = args
+    if op in '+-' and _bound(a) + _bound(b) >= LIMIT:
+        raise _Overflow()
+    if op == '*' and _bound(a) * _bound(b) >= LIMIT:
+        raise _Overflow()
+
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+
+    compare = {'<': np.less, '>': np.greater, 'q': np.equal, 'n': np.not_equal}[op]
+    return compare(a, b).astype(np.int64)
+
+
+def map_tree(a, tree):
+    """Returns the elements of a mapped through the tree, or None."""
+    arr = to_array(a)
+    if arr is None:
+        return None
+
+    try:
+        result = evaluate(tree, arr)
+    except _Overflow:
+        return None
+
+    np = numpy()
+    return from_array(np.broadcast_to(result, arr.shape))
+
+
+def filter_tree(a, tree):
+    """Returns the elements of a for which the tree is nonzero, or None."""
+    arr = to_array(a)
+    if arr is None:
+        return None
+
+    try:
+        mask = evaluate(tree, arr)
+    except _Overflow:
+        return None
+
+    np = numpy()
+    mask = np.broadcast_to(mask, arr.shape)
+    return [e for e, keep in zip(a, mask.tolist()) if keep]
+
+
+def search_tree(start, tree):
+    """Returns (n, None) with n the first integer >= start for which the tree
+    is nonzero. If the search can't be continued exactly, it returns
+    (None, m), with m the first integer not yet checked."""
+    np = numpy()
+    if np is None:
+        return None, start
+
+    block = 1024
+    while abs(start) + block < LIMIT:
+        arr = np.arange(start, start + block, dtype=np.int64)
+        try:
+            mask = np.broadcast_to(evaluate(tree, arr), arr.shape)
+        except _Overflow:
+            break
+
+        hits = np.flatnonzero(mask)
+        if len(hits):
+            return start + int(hits[0]), None
+
+        start += block
+        block = min(2 * block, 2**20)
+
+    return None, start
+
+
+def sort_order(a):
+    """Returns the stable sorting order of a list of integers, or None."""
+    arr = to_array(a)
+    if arr is None:
+        return None
+
+    return arr.argsort(kind='stable').tolist()
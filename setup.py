@@ -18,7 +18,9 @@ setup(
     name='pyth-lang',
     packages=['pyth_lang'],
     install_requires=['sympy'],
-    entry_points={'console_scripts': ['pyth=pyth_lang.pyth:cli']},
+    entry_points={'console_scripts': ['pyth=pyth_lang.pyth:cli',
+                                    'pythc=pyth_lang.client:main',
+                                    'pyth-forkserver=pyth_lang.forkserver:main']},
     version=version,
     description='Pyth programming language.',
     long_description=long_descr,